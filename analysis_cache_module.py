@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from face_matching_module import ENCODING_SIZE
+
+KEYPOINT_NAMES = ('left_eye', 'right_eye', 'nose', 'mouth_left', 'mouth_right')
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 содержимого файла."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Дисковый кэш результатов детекции и кодирования.
+
+    Ключ — хэш содержимого изображения и настроек детектора, поэтому при смене
+    референсных лиц повторяются только сопоставление и размытие. Размер кэша
+    ограничен, при переполнении удаляются давно не использованные записи (LRU по mtime).
+    """
+
+    def __init__(self, folder='.analysis_cache', max_bytes=512 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._size = None  # Текущий размер кэша, вычисляется при первой записи
+
+    def key(self, image_path, settings):
+        settings_hash = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+        return f"{file_hash(image_path)[:40]}_{settings_hash[:16]}"
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        """Результаты MTCNN и кодировки или None, если записи нет."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                boxes, confidences = data['boxes'], data['confidences']
+                keypoints, encodings = data['keypoints'], data['encodings']
+            os.utime(path)  # Отмечаем использование для LRU
+        except (OSError, KeyError, ValueError):
+            return None
+
+        face_boxes = []
+        for box, confidence, points in zip(boxes, confidences, keypoints):
+            face_box = {'box': box.tolist(), 'confidence': float(confidence)}
+            if points[0, 0] >= 0:
+                face_box['keypoints'] = {name: tuple(point) for name, point in zip(KEYPOINT_NAMES, points.tolist())}
+            face_boxes.append(face_box)
+        return face_boxes, list(encodings)
+
+    def put(self, key, face_boxes, encodings):
+        count = len(face_boxes)
+        boxes = np.array([face_box['box'] for face_box in face_boxes], dtype=np.int32).reshape(count, 4)
+        confidences = np.array([face_box.get('confidence', 1.0) for face_box in face_boxes], dtype=np.float32)
+        keypoints = np.full((count, len(KEYPOINT_NAMES), 2), -1, dtype=np.int32)
+        for i, face_box in enumerate(face_boxes):
+            if face_box.get('keypoints'):
+                keypoints[i] = [face_box['keypoints'][name] for name in KEYPOINT_NAMES]
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"  # Несколько процессов могут писать одну запись
+        with open(tmp_path, 'wb') as cache_file:
+            np.savez(cache_file, boxes=boxes, confidences=confidences, keypoints=keypoints,
+                     encodings=np.asarray(encodings, dtype=np.float32).reshape(count, ENCODING_SIZE))
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            self._size = sum(os.path.getsize(entry_path) for entry_path, _ in self._entries())
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        for subdir in os.scandir(self.folder):
+            if subdir.is_dir():
+                for entry in os.scandir(subdir.path):
+                    if entry.name.endswith('.npz'):
+                        yield entry.path, entry.stat()
+
+    def evict(self):
+        """Удаление давно не использованных записей, пока размер не станет меньше 90% лимита."""
+        entries = sorted(self._entries(), key=lambda item: item[1].st_mtime)
+        size = sum(stat.st_size for _, stat in entries)
+        removed = 0
+        for path, stat in entries:
+            if size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= stat.st_size
+            removed += 1
+        self._size = size
+        logging.info(f"Analysis cache: evicted {removed} entries, {size / 2 ** 20:.1f} MiB left.")
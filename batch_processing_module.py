@@ -0,0 +1,149 @@
+import argparse
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from encoding_store_module import open_store
+from face_index_module import gallery_index
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Состояние рабочего процесса: модели загружаются один раз на процесс в init_worker
+_worker_app = None
+_worker_reference_matcher = None
+
+
+def init_worker(selected_faces, detection_size=None, tile_size=None, cache_dir=None, metrics_file=None,
+                profile_dir=None, profile_every=1, quality=90, small_faces=True):
+    """Инициализация рабочего процесса: загрузка MTCNN/dlib и кодировок референсных лиц."""
+    global _worker_app, _worker_reference_matcher
+    # Импорт внутри процесса, чтобы TensorFlow не загружался в родительском процессе до fork
+    from analysis_cache_module import AnalysisCache
+    from metrics_module import REGISTRY, JsonLinesSink
+    from photo_processing_module import PhotoProcessingApp
+
+    if metrics_file:
+        REGISTRY.add_sink(JsonLinesSink(metrics_file))
+    REGISTRY.configure_profiling(profile_dir, profile_every)
+
+    analysis_cache = AnalysisCache(cache_dir) if cache_dir else None
+    _worker_app = PhotoProcessingApp(detection_size=detection_size, tile_size=tile_size, analysis_cache=analysis_cache,
+                                     small_faces=small_faces)
+    _worker_app.selected_faces = list(selected_faces)
+    _worker_app.jpeg_quality = quality
+    _worker_reference_matcher = _worker_app.get_reference_matcher(update_index=False)
+    if not len(_worker_reference_matcher):
+        logging.warning(f"No encodings found for reference faces {selected_faces}.")
+
+
+def process_one(image_path, output_dir):
+    """Обработка одного изображения в рабочем процессе."""
+    output_path = os.path.join(output_dir, os.path.basename(image_path))
+    try:
+        return image_path, _worker_app.process_image(image_path, _worker_reference_matcher, output_path)
+    except Exception as e:
+        logging.error(f"Error processing {image_path}: {e}")
+        return image_path, None
+
+
+def collect_images(inputs):
+    """Сбор списка изображений из каталогов и glob-шаблонов без повторов."""
+    image_paths = []
+    seen = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, f) for f in sorted(os.listdir(pattern))]
+        else:
+            candidates = sorted(glob.glob(pattern, recursive=True))
+        for path in candidates:
+            if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+                key = os.path.abspath(path)
+                if key not in seen:
+                    seen.add(key)
+                    image_paths.append(path)
+    return image_paths
+
+
+def run_batch(inputs, selected_faces, output_dir='output', workers=None, detection_size=None, tile_size=None,
+              cache_dir=None, metrics_file=None, profile_dir=None, profile_every=1, quality=90, small_faces=True):
+    """Пакетное размытие изображений в пуле процессов.
+
+    Возвращает словарь со статистикой: число обработанных, пропущенных изображений и скорость.
+    """
+    image_paths = collect_images(inputs)
+    if not image_paths:
+        logging.warning("No images found for the given inputs.")
+        return {'total': 0, 'processed': 0, 'skipped': 0, 'seconds': 0.0, 'images_per_second': 0.0}
+
+    os.makedirs(output_dir, exist_ok=True)
+    names = [os.path.basename(path) for path in image_paths]
+    if len(set(names)) != len(names):
+        logging.warning("Some input images share a file name; later outputs will overwrite earlier ones.")
+
+    # Индекс дополняется один раз здесь, рабочие процессы его только читают
+    gallery_index(open_store(), selected_faces)
+
+    workers = workers or os.cpu_count() or 1
+    logging.info(f"Processing {len(image_paths)} images with {workers} workers.")
+
+    processed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(tuple(selected_faces), detection_size, tile_size, cache_dir, metrics_file,
+                                       profile_dir, profile_every, quality, small_faces)) as executor:
+        futures = [executor.submit(process_one, path, output_dir) for path in image_paths]
+        for done, future in enumerate(as_completed(futures), start=1):
+            image_path, output_path = future.result()
+            if output_path is not None:
+                processed += 1
+            else:
+                logging.warning(f"Skipped {image_path}.")
+            elapsed = time.perf_counter() - start
+            logging.info(f"[{done}/{len(image_paths)}] {done / elapsed:.2f} images/s")
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'total': len(image_paths),
+        'processed': processed,
+        'skipped': len(image_paths) - processed,
+        'seconds': elapsed,
+        'images_per_second': len(image_paths) / elapsed if elapsed else 0.0,
+    }
+    logging.info(f"Done: {stats['processed']}/{stats['total']} images in {elapsed:.1f}s "
+                 f"({stats['images_per_second']:.2f} images/s).")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch blur of faces except the selected reference identities.")
+    parser.add_argument('inputs', nargs='+', help="Input directories or glob patterns")
+    parser.add_argument('-f', '--faces', nargs='+', required=True, help="Reference identity names to keep unblurred")
+    parser.add_argument('-o', '--output-dir', default='output', help="Directory for blurred images")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--detection-size', type=int, default=None,
+                        help="Run face detection on a copy with this longest side (e.g. 1600); faces too small "
+                             "for the copy are then searched in an extra full-resolution pass")
+    parser.add_argument('--skip-small-faces', action='store_true',
+                        help="With --detection-size, skip the full-resolution pass: faster, but faces smaller "
+                             "than about 5 * image side / detection size pixels are not blurred")
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help="Process large images in overlapping tiles of this size instead of downscaling them")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Directory for cached detections and encodings, reused across runs")
+    parser.add_argument('--metrics-file', default=None, help="Append per-image stage timings as JSON lines")
+    parser.add_argument('--profile-dir', default=None, help="Save a cProfile dump per profiled image here")
+    parser.add_argument('--profile-every', type=int, default=1, help="Profile every N-th image per worker")
+    parser.add_argument('--quality', type=int, default=90, help="JPEG quality of the blurred images")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    stats = run_batch(args.inputs, args.faces, args.output_dir, args.workers, args.detection_size, args.tile_size,
+                      args.cache_dir, args.metrics_file, args.profile_dir, args.profile_every, args.quality,
+                      not args.skip_small_faces)
+    return 0 if stats['total'] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,250 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from face_matching_module import ENCODING_SIZE, ReferenceMatcher
+from lazy_import_module import lazy_import
+from metrics_module import REGISTRY
+
+cv2 = lazy_import('cv2')
+
+DEFAULT_RESOLUTIONS = (1024, 2048, 4096)
+DEFAULT_FACE_COUNTS = (1, 10, 50)
+DEFAULT_GALLERY_SIZES = (100, 1000, 10000)
+MANIFEST_FILE = 'manifest.json'
+
+
+def peak_rss_mb():
+    """Пиковый объём памяти процесса в МиБ."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # macOS — байты, Linux — КиБ
+
+
+def summarize(samples):
+    """Статистика по замерам одного этапа."""
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples)
+    total = float(values.sum())
+    return {
+        'count': len(values),
+        'mean_ms': float(values.mean()) * 1000,
+        'p50_ms': float(np.percentile(values, 50)) * 1000,
+        'p95_ms': float(np.percentile(values, 95)) * 1000,
+        'throughput_per_s': len(values) / total if total else 0.0,
+    }
+
+
+class StageTimer:
+    """Сбор времени выполнения этапов."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def measure(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.add(stage, time.perf_counter() - start)
+        return result
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def report(self):
+        return {stage: summarize(samples) for stage, samples in self.samples.items()}
+
+
+def load_face_crops(faces_folder='faces', limit=200):
+    """Вырезанные лица из галереи для вставки в синтетические изображения."""
+    paths = sorted(glob.glob(os.path.join(faces_folder, '*', '*.jpg')))[:limit]
+    crops = [crop for crop in (cv2.imread(path) for path in paths) if crop is not None]
+    return crops
+
+
+def generate_fixtures(folder, resolutions=DEFAULT_RESOLUTIONS, face_counts=DEFAULT_FACE_COUNTS,
+                      faces_folder='faces', seed=0):
+    """Создание воспроизводимого набора изображений с известными рамками лиц.
+
+    Лица берутся из галереи faces/; если она пуста, вместо лиц рисуются
+    эллипсы (детектор их не найдёт, но этапы размытия и сохранения измеряются).
+    """
+    rng = np.random.default_rng(seed)
+    crops = load_face_crops(faces_folder)
+    os.makedirs(folder, exist_ok=True)
+    manifest = []
+    for resolution in resolutions:
+        height, width = resolution * 3 // 4, resolution
+        for face_count in face_counts:
+            # Плавный фон с шумом: сжимается как фотография, а не как однотонная заливка
+            gradient = np.linspace(40, 200, width, dtype=np.float32)[None, :, None]
+            image = np.clip(gradient + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+            face_size = max(24, min(height, width) // max(4, int(np.sqrt(face_count)) * 2))
+            boxes = []
+            for i in range(face_count):
+                size = int(face_size * rng.uniform(0.6, 1.0))
+                top = int(rng.integers(0, height - size))
+                left = int(rng.integers(0, width - size))
+                if crops:
+                    image[top:top + size, left:left + size] = cv2.resize(crops[i % len(crops)], (size, size))
+                else:
+                    center = (left + size // 2, top + size // 2)
+                    cv2.ellipse(image, center, (size // 3, size // 2), 0, 0, 360, (150, 170, 210), -1)
+                boxes.append((top, left + size, top + size, left))
+
+            file_name = f"bench_{resolution}px_{face_count}faces.jpg"
+            cv2.imwrite(os.path.join(folder, file_name), image)
+            manifest.append({'file_name': file_name, 'resolution': resolution,
+                             'face_count': face_count, 'boxes': boxes})
+
+    with open(os.path.join(folder, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump({'seed': seed, 'real_faces': bool(crops), 'images': manifest}, manifest_file, indent=4)
+    logging.info(f"Generated {len(manifest)} fixture images in {folder}.")
+    return manifest
+
+
+def load_fixtures(folder, **kwargs):
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return generate_fixtures(folder, **kwargs)
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)['images']
+
+
+def synthetic_gallery(size, identities=100, seed=0):
+    """Галерея случайных кодировок с масштабом, близким к кодировкам dlib."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 0.09, (identities, ENCODING_SIZE)).astype(np.float32)
+    labels = rng.integers(0, identities, size)
+    encodings = centers[labels] + rng.normal(0, 0.03, (size, ENCODING_SIZE)).astype(np.float32)
+    return {f"person_{i}": encodings[labels == i] for i in range(identities)}
+
+
+def bench_pipeline(app, fixtures, fixtures_folder, timer, repeat=1):
+    """Замер этапов обработки изображения: декодирование, детекция, кодирование, размытие, сохранение."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        for _ in range(repeat):
+            for fixture in fixtures:
+                image_path = os.path.join(fixtures_folder, fixture['file_name'])
+                label = f"{fixture['resolution']}px"
+                img_rgb = timer.measure('decode', app.load_image, image_path)
+                face_boxes, face_locations = timer.measure('detect', app.detect_faces, img_rgb)
+                timer.add(f'detect_{label}', timer.samples['detect'][-1])  # Детекция по разрешениям
+                # Рамки из описания набора, если детектор ничего не нашёл (например, без галереи лиц)
+                locations = face_locations or [tuple(box) for box in fixture['boxes']]
+                if face_locations:
+                    timer.measure('encode', app.encode_faces, img_rgb, face_locations)
+                timer.measure('blur', app.blur_engine.apply, img_rgb, locations)
+                timer.measure('save', app.save_image, img_rgb, os.path.join(output_dir, fixture['file_name']))
+
+
+def bench_matching(timer, gallery_sizes=DEFAULT_GALLERY_SIZES, faces_per_image=50, repeat=20):
+    """Замер сопоставления лиц с галереями разного размера."""
+    rng = np.random.default_rng(1)
+    for size in gallery_sizes:
+        gallery = synthetic_gallery(size)
+        matcher = timer.measure(f'match_build_{size}', ReferenceMatcher, gallery)
+        queries = rng.normal(0, 0.09, (faces_per_image, ENCODING_SIZE)).astype(np.float32)
+        for _ in range(repeat):
+            timer.measure(f'match_{size}', matcher.match, queries)
+
+
+def bench_training(timer, faces_folder='faces', limit=64):
+    """Замер кодирования вырезанных лиц, как при обучении."""
+    from model_training_module import encode_image_files
+
+    paths = sorted(glob.glob(os.path.join(faces_folder, '*', '*.jpg')))[:limit]
+    for path in paths:
+        timer.measure('train_encode', encode_image_files, [path])
+
+
+def run_benchmark(fixtures_folder='bench_fixtures', output_path='bench_results.json', label=None,
+                  repeat=1, stages=('pipeline', 'match', 'train')):
+    timer = StageTimer()
+    start = time.perf_counter()
+    if 'pipeline' in stages:
+        from photo_processing_module import PhotoProcessingApp
+
+        fixtures = load_fixtures(fixtures_folder)
+        app = timer.measure('startup', PhotoProcessingApp)
+        timer.measure('warm_up', app.warm_up)
+        bench_pipeline(app, fixtures, fixtures_folder, timer, repeat)
+    if 'match' in stages:
+        bench_matching(timer)
+    if 'train' in stages:
+        bench_training(timer)
+
+    results = {
+        'label': label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seconds': time.perf_counter() - start,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': timer.report(),
+        'metrics': REGISTRY.snapshot(),  # Счётчики пайплайна, например попадания в кэш
+    }
+    with open(output_path, 'w') as results_file:
+        json.dump(results, results_file, indent=4)
+    logging.info(f"Benchmark results saved to {output_path}.")
+    return results
+
+
+def compare(baseline, current, tolerance=0.1):
+    """Этапы, у которых p50 вырос больше чем на tolerance относительно базового прогона."""
+    regressions = {}
+    for stage, stats in current['stages'].items():
+        base = baseline['stages'].get(stage)
+        if not base or not base.get('count') or not stats.get('count'):
+            continue
+        change = stats['p50_ms'] / base['p50_ms'] - 1.0 if base['p50_ms'] else 0.0
+        if change > tolerance:
+            regressions[stage] = {'baseline_p50_ms': base['p50_ms'], 'p50_ms': stats['p50_ms'], 'change': change}
+    return regressions
+
+
+def print_report(results):
+    print(f"{'stage':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'per s':>10}")
+    for stage, stats in sorted(results['stages'].items()):
+        if stats['count']:
+            print(f"{stage:<24}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                  f"{stats['throughput_per_s']:>10.2f}")
+    print(f"peak RSS: {results['peak_rss_mb']:.1f} MiB, total {results['seconds']:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the detect/encode/match/blur pipeline.")
+    parser.add_argument('--fixtures', default='bench_fixtures', help="Fixture folder (generated if missing)")
+    parser.add_argument('--output', default='bench_results.json', help="Machine-readable results file")
+    parser.add_argument('--label', default=None, help="Label stored with the results, e.g. a version")
+    parser.add_argument('--repeat', type=int, default=1, help="Number of passes over the fixture images")
+    parser.add_argument('--stages', nargs='+', default=['pipeline', 'match', 'train'],
+                        choices=['pipeline', 'match', 'train'])
+    parser.add_argument('--compare', default=None, help="Baseline results file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative p50 slowdown")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    results = run_benchmark(args.fixtures, args.output, args.label, args.repeat, args.stages)
+    print_report(results)
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            regressions = compare(json.load(baseline_file), results, args.tolerance)
+        for stage, regression in regressions.items():
+            print(f"REGRESSION {stage}: {regression['baseline_p50_ms']:.2f} -> {regression['p50_ms']:.2f} ms "
+                  f"(+{regression['change']:.0%})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,115 @@
+import numpy as np
+
+from lazy_import_module import lazy_import
+
+cv2 = lazy_import('cv2')
+
+BLUR_MODES = ('gaussian', 'box', 'pixelate', 'fill')
+
+
+def clip_box(location, shape):
+    """Обрезка рамки (top, right, bottom, left) по границам изображения."""
+    height, width = shape[:2]
+    top, right, bottom, left = location
+    return max(0, top), min(width, right), min(height, bottom), max(0, left)
+
+
+def boxes_overlap(a, b):
+    return a[3] < b[1] and b[3] < a[1] and a[0] < b[2] and b[0] < a[2]
+
+
+def merge_boxes(locations, shape):
+    """Группировка пересекающихся рамок.
+
+    Возвращает список (общая рамка группы, рамки группы); каждая группа размывается один раз.
+    """
+    boxes = []
+    for location in locations:
+        box = clip_box(location, shape)
+        if box[1] > box[3] and box[2] > box[0] and box not in boxes:
+            boxes.append(box)
+
+    # Объединение пересекающихся рамок (система непересекающихся множеств)
+    parents = list(range(len(boxes)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i in range(len(boxes)):
+        for j in range(i + 1, len(boxes)):
+            if boxes_overlap(boxes[i], boxes[j]):
+                parents[find(i)] = find(j)
+
+    groups = {}
+    for i, box in enumerate(boxes):
+        groups.setdefault(find(i), []).append(box)
+
+    regions = []
+    for group in groups.values():
+        region = (min(box[0] for box in group), max(box[1] for box in group),
+                  max(box[2] for box in group), min(box[3] for box in group))
+        regions.append((region, group))
+    return regions
+
+
+class BlurEngine:
+    """Размытие областей лиц с учётом их размера.
+
+    Режимы: gaussian и box (для больших лиц размытие выполняется на уменьшенной копии
+    и масштабируется обратно), pixelate и fill (заливка цветом).
+    """
+
+    def __init__(self, mode='gaussian', strength=0.3, max_blur_size=64, pixel_blocks=8, fill_color=(0, 0, 0)):
+        if mode not in BLUR_MODES:
+            raise ValueError(f"Unknown blur mode {mode!r}, expected one of {BLUR_MODES}")
+        self.mode = mode
+        self.strength = strength  # Сила размытия относительно размера лица
+        self.max_blur_size = max_blur_size  # Максимальная сторона уменьшенной копии для размытия
+        self.pixel_blocks = pixel_blocks  # Количество блоков пикселизации по стороне лица
+        self.fill_color = fill_color
+
+    def apply(self, image, locations):
+        """Размытие лиц на месте; каждый пиксель обрабатывается не более одного раза."""
+        for (top, right, bottom, left), boxes in merge_boxes(locations, image.shape):
+            roi = image[top:bottom, left:right]  # Представление без копирования
+            face_size = max(min(box[1] - box[3], box[2] - box[0]) for box in boxes)
+            effect = self.effect(roi, face_size)
+            if len(boxes) == 1:
+                roi[...] = effect
+            else:
+                mask = np.zeros(roi.shape[:2], dtype=bool)
+                for box_top, box_right, box_bottom, box_left in boxes:
+                    mask[box_top - top:box_bottom - top, box_left - left:box_right - left] = True
+                np.copyto(roi, effect, where=mask[..., None] if roi.ndim == 3 else mask)
+        return image
+
+    def effect(self, roi, face_size):
+        """Размытая версия области."""
+        height, width = roi.shape[:2]
+        if self.mode == 'fill':
+            return np.broadcast_to(np.array(self.fill_color[:roi.shape[2]] if roi.ndim == 3 else self.fill_color[0],
+                                            dtype=roi.dtype), roi.shape)
+
+        if self.mode == 'pixelate':
+            block = max(1, face_size // self.pixel_blocks)
+            small = cv2.resize(roi, (max(1, width // block), max(1, height // block)), interpolation=cv2.INTER_AREA)
+            return cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+
+        # Размытие на уменьшенной копии: стоимость не зависит от размера лица
+        scale = min(1.0, self.max_blur_size / max(height, width))
+        small = roi
+        if scale < 1.0:
+            small = cv2.resize(roi, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        radius = max(1.0, self.strength * face_size * scale)
+        if self.mode == 'gaussian':
+            small = cv2.GaussianBlur(small, (0, 0), radius)
+        else:
+            kernel = int(radius) * 2 + 1
+            small = cv2.blur(small, (kernel, kernel))
+        if scale < 1.0:
+            return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+        return small
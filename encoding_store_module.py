@@ -0,0 +1,326 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+from face_matching_module import ENCODING_SIZE
+
+DATA_FILE = 'encodings.f32'  # Матрица кодировок float32 (N x 128) без заголовка
+INDEX_FILE = 'encodings_index.jsonl'  # Индекс: одна строка JSON на строку матрицы или удаление
+LOCK_FILE = '.encodings.lock'  # Блокировка записи для нескольких процессов
+
+
+class EncodingStore(Mapping):
+    """Бинарное хранилище кодировок лиц.
+
+    Все кодировки лежат в одном файле float32, который открывается через memmap,
+    а индекс хранит имя лица и имя файла для каждой строки. Новые кодировки
+    дописываются в конец, удаления записываются в индекс отдельными строками.
+    Хранилище ведёт себя как словарь {имя: матрица кодировок}.
+    """
+
+    def __init__(self, folder='faces'):
+        self.folder = folder
+        self.data_path = os.path.join(folder, DATA_FILE)
+        self.index_path = os.path.join(folder, INDEX_FILE)
+        self.lock_path = os.path.join(folder, LOCK_FILE)
+        self._row_count = None
+        self._files = None  # {имя: {имя файла: {'rows': [...], ...}}}
+        self._names = None
+        self._matrix = None
+        self._generation = None  # Меняется при каждой полной перезаписи: номера строк становятся другими
+        self._stamp = None  # inode, mtime и размер индекса при последнем чтении
+        self._thread_lock = threading.Lock()
+
+    def exists(self):
+        return os.path.isfile(self.index_path)
+
+    def reload(self):
+        """Сброс кэша; данные будут перечитаны при следующем обращении."""
+        self._row_count = None
+        self._files = None
+        self._names = None
+        self._matrix = None
+
+    def _index_stamp(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _locked(self):
+        """Монопольная запись: другие процессы и потоки ждут, пока блок не завершится.
+
+        Под блокировкой состояние в памяти сверяется с индексом на диске, поэтому
+        запись всегда опирается на строки, дописанные другими экземплярами.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        with self._thread_lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # Снимается при закрытии файла
+            self.refresh()
+            self._load()
+            self._repair_index()
+            yield
+
+    def locked(self):
+        """Монопольный доступ к хранилищу и файлам рядом с ним, например к индексу FaceIndex."""
+        return self._locked()
+
+    def _repair_index(self):
+        """Отрезать недописанную последнюю строку индекса, оставшуюся после сбоя."""
+        if not self.exists():
+            return
+        with open(self.index_path, 'rb+') as index_file:
+            size = index_file.seek(0, os.SEEK_END)
+            if not size:
+                return
+            index_file.seek(size - 1)
+            if index_file.read(1) == b'\n':
+                return
+            index_file.seek(max(0, size - (1 << 16)))
+            tail = index_file.read()
+            index_file.truncate(size - len(tail) + tail.rfind(b'\n') + 1)
+        self._stamp = self._index_stamp()
+
+    def refresh(self):
+        """Перечитать хранилище, если индекс изменил другой процесс; возвращает True при изменении."""
+        if self._files is None or self._index_stamp() == self._stamp:
+            return False
+        self.reload()
+        return True
+
+    def _load(self):
+        if self._files is not None:
+            return
+        files = {}
+        row_count = 0
+        generation = None
+        self._stamp = self._index_stamp()
+        if self.exists():
+            with open(self.index_path, 'r') as index_file:
+                for line in index_file:
+                    if not line.endswith('\n'):
+                        break  # Строка ещё дописывается другим процессом
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record.get('op') == 'generation':
+                        generation = record['id']
+                        continue
+                    name_files = files.setdefault(record['name'], {})
+                    if record.get('op') == 'delete':
+                        name_files.pop(record['file_name'], None)
+                        continue
+                    file_info = name_files.get(record['file_name'])
+                    if file_info is None:
+                        file_info = {key: value for key, value in record.items() if key not in ('name', 'file_name')}
+                        file_info['rows'] = []
+                        name_files[record['file_name']] = file_info
+                    if not record.get('empty'):  # Файл без лиц не занимает строк матрицы
+                        file_info['rows'].append(row_count)
+                        row_count += 1
+        self._files = {name: name_files for name, name_files in files.items() if name_files}
+        self._names = sorted(name for name, name_files in self._files.items()
+                             if any(file_info['rows'] for file_info in name_files.values()))
+        self._row_count = row_count
+        self._generation = generation
+
+    @property
+    def row_count(self):
+        """Число строк матрицы, включая удалённые."""
+        self._load()
+        return self._row_count
+
+    @property
+    def generation(self):
+        """Идентификатор нумерации строк; None у хранилищ, ни разу не перезаписанных целиком."""
+        self._load()
+        return self._generation
+
+    @property
+    def matrix(self):
+        """Вся матрица кодировок, открытая через memmap без копирования."""
+        if self._matrix is None:
+            self._load()
+            if self._row_count:
+                self._matrix = np.memmap(self.data_path, dtype=np.float32, mode='r',
+                                         shape=(self._row_count, ENCODING_SIZE))
+            else:
+                self._matrix = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        return self._matrix
+
+    def identities(self):
+        """Все имена с файлами, включая те, в файлах которых лиц не нашлось."""
+        self._load()
+        return sorted(self._files)
+
+    def rows(self, name):
+        """Номера строк матрицы для лица."""
+        self._load()
+        return sorted(row for file_info in self._files.get(name, {}).values() for row in file_info['rows'])
+
+    def files(self, name):
+        """Сведения о закодированных файлах лица: {имя файла: {'rows': [...], 'mtime': ..., ...}}."""
+        self._load()
+        return self._files.get(name, {})
+
+    def __getitem__(self, name):
+        rows = self.rows(name)
+        if not rows:
+            raise KeyError(name)
+        if rows[-1] - rows[0] + 1 == len(rows):
+            return self.matrix[rows[0]:rows[-1] + 1]  # Непрерывный блок — представление без копии
+        return self.matrix[rows]
+
+    def __iter__(self):
+        self._load()
+        return iter(self._names)
+
+    def __len__(self):
+        self._load()
+        return len(self._names)
+
+    def append(self, name, file_name, encodings, **meta):
+        """Дописать кодировки файла в конец хранилища."""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        with self._locked():
+            # Сначала данные, затем индекс: индекс никогда не ссылается на недописанные строки
+            self._truncate_data(self._row_count)
+            with open(self.data_path, 'ab') as data_file:
+                data_file.write(encodings.tobytes())
+            with open(self.index_path, 'a') as index_file:
+                self._write_index(index_file, name, file_name, len(encodings), meta)
+            self._stamp = self._index_stamp()
+            self._add_rows(name, file_name, len(encodings), meta)
+
+    def _add_rows(self, name, file_name, count, meta):
+
+        # Обновляем индекс в памяти без повторного чтения файла
+        rows = list(range(self._row_count, self._row_count + count))
+        file_info = self._files.setdefault(name, {}).get(file_name)
+        if file_info is None:
+            self._files[name][file_name] = dict(meta, rows=rows)
+        else:
+            file_info['rows'].extend(rows)
+        self._row_count += count
+        if rows and name not in self._names:
+            self._names = sorted(self._names + [name])
+        self._matrix = None
+
+    def upsert(self, name, file_name, encodings, **meta):
+        """Заменить кодировки файла новыми."""
+        if file_name in self.files(name):
+            self.remove(name, file_name)
+        self.append(name, file_name, encodings, **meta)
+
+    def remove(self, name, file_name):
+        """Пометить кодировки файла как удалённые."""
+        with self._locked():
+            with open(self.index_path, 'a') as index_file:
+                index_file.write(json.dumps({'op': 'delete', 'name': name, 'file_name': file_name}) + '\n')
+            self._stamp = self._index_stamp()
+            self._drop_file(name, file_name)
+
+    def _drop_file(self, name, file_name):
+        name_files = self._files.get(name, {})
+        name_files.pop(file_name, None)
+        if not name_files:
+            self._files.pop(name, None)
+        if name in self._names and not any(file_info['rows'] for file_info in name_files.values()):
+            self._names.remove(name)
+
+    @staticmethod
+    def _write_index(index_file, name, file_name, count, meta):
+        record = json.dumps(dict(meta, name=name, file_name=file_name))
+        if count == 0:
+            # Запоминаем файл без лиц, чтобы не обрабатывать его повторно
+            record = json.dumps(dict(meta, name=name, file_name=file_name, empty=True))
+        index_file.write((record + '\n') * max(count, 1))
+
+    def _truncate_data(self, row_count):
+        """Отрезать строки, записанные без индекса (например, после сбоя)."""
+        expected_size = row_count * ENCODING_SIZE * np.dtype(np.float32).itemsize
+        if os.path.isfile(self.data_path) and os.path.getsize(self.data_path) > expected_size:
+            self._matrix = None
+            with open(self.data_path, 'r+b') as data_file:
+                data_file.truncate(expected_size)
+
+    def write(self, records):
+        """Полная перезапись хранилища.
+
+        records — итерируемое из (имя, имя файла, кодировки, метаданные).
+        """
+        with self._locked():
+            self._write_locked(records)
+
+    def _write_locked(self, records):
+        data_tmp = self.data_path + '.tmp'
+        index_tmp = self.index_path + '.tmp'
+        with open(data_tmp, 'wb') as data_file, open(index_tmp, 'w') as index_file:
+            index_file.write(json.dumps({'op': 'generation', 'id': uuid.uuid4().hex}) + '\n')
+            for name, file_name, encodings, meta in records:
+                encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+                data_file.write(encodings.tobytes())
+                self._write_index(index_file, name, file_name, len(encodings), meta)
+        self._matrix = None  # Закрываем memmap перед заменой файла
+        os.replace(data_tmp, self.data_path)
+        os.replace(index_tmp, self.index_path)
+        self.reload()
+
+    def compact(self):
+        """Перезапись без удалённых строк; кодировки каждого лица становятся непрерывным блоком."""
+        with self._locked():
+            records = []
+            for name in sorted(self._files):
+                for file_name, file_info in sorted(self.files(name).items()):
+                    meta = {key: value for key, value in file_info.items() if key != 'rows'}
+                    records.append((name, file_name, np.array(self.matrix[file_info['rows']]), meta))
+            self._write_locked(records)
+
+
+def find_json_files(faces_folder='faces'):
+    """Поиск JSON-файлов кодировок в старом формате faces/<имя>/<имя>.json."""
+    json_files = {}
+    if os.path.isdir(faces_folder):
+        for name in sorted(os.listdir(faces_folder)):
+            json_file_path = os.path.join(faces_folder, name, f"{name}.json")
+            if os.path.isfile(json_file_path):
+                json_files[name] = json_file_path
+    return json_files
+
+
+def migrate_from_json(faces_folder='faces'):
+    """Однократный перенос кодировок из JSON-файлов в бинарное хранилище."""
+    records = []
+    for name, json_file_path in find_json_files(faces_folder).items():
+        with open(json_file_path, 'r') as json_file:
+            data = json.load(json_file)
+        for face in data['files']:
+            records.append((name, face['file_name'], face['encodings'], {}))
+        logging.info(f"Migrating {len(data['files'])} encodings for {name}.")
+
+    store = EncodingStore(faces_folder)
+    store.write(records)
+    logging.info(f"Migrated {len(records)} encodings to {store.data_path}.")
+    return store
+
+
+def open_store(faces_folder='faces'):
+    """Открыть хранилище, при необходимости выполнив миграцию из JSON."""
+    store = EncodingStore(faces_folder)
+    if not store.exists() and find_json_files(faces_folder):
+        store = migrate_from_json(faces_folder)
+    return store
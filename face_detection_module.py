@@ -0,0 +1,165 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from lazy_import_module import lazy_import
+
+# MTCNN тянет за собой TensorFlow, поэтому импортируется при первой детекции
+cv2 = lazy_import('cv2')
+mtcnn = lazy_import('mtcnn')
+
+
+def transform_face_box(face_box, scale=1.0, offset_x=0, offset_y=0):
+    """Перевод результата MTCNN в другую систему координат: (x * scale + offset_x, y * scale + offset_y)."""
+    x, y, width, height = face_box['box']
+    transformed = dict(face_box)
+    transformed['box'] = [int(round(x * scale)) + offset_x, int(round(y * scale)) + offset_y,
+                          int(round(width * scale)), int(round(height * scale))]
+    if face_box.get('keypoints'):
+        transformed['keypoints'] = {name: (int(round(px * scale)) + offset_x, int(round(py * scale)) + offset_y)
+                                    for name, (px, py) in face_box['keypoints'].items()}
+    return transformed
+
+
+def iter_tiles(height, width, tile_size, overlap):
+    """Координаты перекрывающихся плиток (top, right, bottom, left)."""
+    step = max(1, tile_size - overlap)
+    tops = list(range(0, max(height - overlap, 1), step))
+    lefts = list(range(0, max(width - overlap, 1), step))
+    for top in tops:
+        for left in lefts:
+            yield top, min(width, left + tile_size), min(height, top + tile_size), left
+
+
+def non_max_suppression(face_boxes, iou_threshold=0.3):
+    """Удаление дублирующихся рамок: из пересекающихся остаётся рамка с наибольшей уверенностью."""
+    if not face_boxes:
+        return []
+    boxes = np.array([face_box['box'] for face_box in face_boxes], dtype=np.float32)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    order = np.argsort([-face_box.get('confidence', 0.0) for face_box in face_boxes])
+
+    keep = []
+    while len(order):
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        width = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        height = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        intersection = width * height
+        # Учитываем и IoU, и вложенность маленькой рамки в большую (обрезанные лица на краях областей)
+        iou = intersection / np.maximum(areas[i] + areas[rest] - intersection, 1e-6)
+        containment = intersection / np.maximum(np.minimum(areas[i], areas[rest]), 1e-6)
+        order = rest[(iou <= iou_threshold) & (containment <= 0.8)]
+    return [face_boxes[i] for i in sorted(keep)]
+
+
+class FaceDetector:
+    """Детектор MTCNN с поддержкой детекции на уменьшенной копии.
+
+    При заданном detection_size детекция выполняется на копии с длинной стороной
+    detection_size, а рамки переводятся в координаты оригинала. Неуверенные и
+    маленькие лица перепроверяются на оригинале только в окрестности рамки.
+    Лица меньше min_face_size на копии (min_face_size / scale в оригинале) копия
+    не находит вовсе; их ищет отдельный проход по плиткам оригинала. Без него
+    (small_face_pass=False) детекция быстрее, но такие лица остаются неразмытыми.
+    """
+
+    def __init__(self, min_face_size=5, thresholds=1.9, detection_size=None,
+                 refine_confidence=0.95, tiny_face_size=24, refine_padding=0.5, small_face_pass=True,
+                 small_face_tile=2048):
+        self.min_face_size = min_face_size
+        self.thresholds = thresholds
+        self.detection_size = detection_size  # None — детекция в полном разрешении
+        self.refine_confidence = refine_confidence  # Ниже этой уверенности лицо перепроверяется
+        self.tiny_face_size = tiny_face_size  # Лица меньше этого размера на копии перепроверяются
+        self.refine_padding = refine_padding  # Запас вокруг рамки при перепроверке, в долях её размера
+        self.small_face_pass = small_face_pass  # Искать в оригинале лица, слишком мелкие для копии
+        self.small_face_tile = small_face_tile
+        self._mtcnn = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Создание модели MTCNN при первом обращении."""
+        with self._lock:
+            if self._mtcnn is None:
+                self._mtcnn = mtcnn.MTCNN()
+            return self._mtcnn
+
+    def detect_raw(self, img):
+        """Детекция MTCNN без изменения масштаба."""
+        return (self._mtcnn or self.load()).detect_faces(img, self.min_face_size, self.thresholds)
+
+    def detect_faces(self, img):
+        height, width = img.shape[:2]
+        if not self.detection_size or max(height, width) <= self.detection_size:
+            return self.detect_raw(img)
+
+        scale = self.detection_size / max(height, width)
+        proxy = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        face_boxes = []
+        uncertain = []
+        for face_box in self.detect_raw(proxy):
+            if face_box['confidence'] < self.refine_confidence or min(face_box['box'][2:]) < self.tiny_face_size:
+                uncertain.append(transform_face_box(face_box, 1.0 / scale))
+            else:
+                face_boxes.append(transform_face_box(face_box, 1.0 / scale))
+
+        for face_box in uncertain:
+            refined = self.refine(img, face_box)
+            # Если перепроверка ничего не нашла, оставляем рамку: лишнее размытие лучше пропущенного лица
+            face_boxes.extend(refined or [face_box])
+        if self.small_face_pass:
+            face_boxes.extend(self.detect_small(img, self.min_face_size / scale))
+        return non_max_suppression(face_boxes)
+
+    def detect_small(self, img, max_face_size):
+        """Лица меньше max_face_size в полном разрешении, по плиткам small_face_tile.
+
+        Оставляются лица меньше удвоенного порога: у самой границы копия находит
+        не все лица, а дубликаты с рамками копии удаляет NMS.
+        """
+        height, width = img.shape[:2]
+        overlap = int(2 * max_face_size) + 1  # Лицо на границе целиком попадает в одну из плиток
+        found = []
+        for top, right, bottom, left in iter_tiles(height, width, self.small_face_tile, overlap):
+            for face_box in self.detect_raw(img[top:bottom, left:right]):
+                if min(face_box['box'][2:]) < 2 * max_face_size:
+                    found.append(transform_face_box(face_box, 1.0, left, top))
+        return found
+
+    def refine(self, img, face_box):
+        """Повторная детекция в полном разрешении в окрестности рамки."""
+        height, width = img.shape[:2]
+        x, y, box_width, box_height = face_box['box']
+        pad_x, pad_y = int(box_width * self.refine_padding), int(box_height * self.refine_padding)
+        left, top = max(0, x - pad_x), max(0, y - pad_y)
+        right, bottom = min(width, x + box_width + pad_x), min(height, y + box_height + pad_y)
+        if right <= left or bottom <= top:
+            return []
+        tile = img[top:bottom, left:right]
+        return [transform_face_box(found, 1.0, left, top) for found in self.detect_raw(tile)]
+
+    def detect_tiled(self, img, tile_size=2048, overlap=256, workers=1):
+        """Детекция по перекрывающимся плиткам без уменьшения изображения.
+
+        Плитки — представления исходного массива, поэтому дополнительная память
+        пропорциональна размеру плитки. Перекрытие должно быть больше самого крупного
+        лица, которое может оказаться на границе; дубликаты на границах удаляются NMS.
+        """
+        height, width = img.shape[:2]
+        tiles = list(iter_tiles(height, width, tile_size, overlap))
+
+        def detect_tile(tile):
+            top, right, bottom, left = tile
+            return [transform_face_box(found, 1.0, left, top) for found in self.detect_faces(img[top:bottom, left:right])]
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(detect_tile, tiles))
+        else:
+            results = [detect_tile(tile) for tile in tiles]
+        return non_max_suppression([face_box for tile_boxes in results for face_box in tile_boxes])
@@ -0,0 +1,129 @@
+import logging
+import os
+import uuid
+
+import numpy as np
+
+from face_matching_module import MIN_INDEX_SIZE
+
+INDEX_FILE = 'encodings_ivf.npz'
+
+
+def squared_distances(queries, points):
+    """Квадраты евклидовых расстояний (запросы x точки)."""
+    squared = (np.einsum('ij,ij->i', queries, queries)[:, None]
+               + np.einsum('ij,ij->i', points, points)[None, :]
+               - 2.0 * queries @ points.T)
+    return np.maximum(squared, 0.0, out=squared)
+
+
+def kmeans(points, clusters, iterations=10, seed=0):
+    """Простой k-means на NumPy; возвращает центроиды и номера кластеров точек."""
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = np.argmin(squared_distances(points, centroids), axis=1)
+        for cluster in range(clusters):
+            members = points[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+    return centroids, np.argmin(squared_distances(points, centroids), axis=1).astype(np.int32)
+
+
+class FaceIndex:
+    """Инвертированный индекс (IVF) по матрице кодировок хранилища.
+
+    Кодировки разбиты на кластеры k-means; при поиске проверяются только
+    n_probe ближайших к запросу кластеров. Индекс хранится рядом с кодировками
+    и дополняется при появлении новых строк, а при сильном росте галереи или
+    перезаписи хранилища (другое поколение строк) перестраивается.
+    """
+
+    def __init__(self, folder='faces', rebuild_factor=4.0):
+        self.path = os.path.join(folder, INDEX_FILE)
+        self.rebuild_factor = rebuild_factor  # Перестройка, когда строк стало в столько раз больше
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)  # Кластер каждой строки матрицы хранилища
+        self.built_rows = 0
+        self.generation = None  # Поколение хранилища, по строкам которого построен индекс
+
+    def load(self):
+        if os.path.isfile(self.path):
+            with np.load(self.path) as data:
+                self.centroids = data['centroids']
+                self.assignments = data['assignments']
+                self.built_rows = int(data['built_rows'])
+                self.generation = str(data['generation']) if 'generation' in data else None
+        return self
+
+    def is_current(self, store):
+        """Индекс построен по текущим строкам хранилища и покрывает их все."""
+        return self.centroids is not None and self.generation == store.generation \
+            and len(self.assignments) == store.row_count
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.{uuid.uuid4().hex}.tmp.npz"  # Своё имя у каждого процесса
+        extra = {} if self.generation is None else {'generation': self.generation}
+        np.savez(tmp_path, centroids=self.centroids, assignments=self.assignments, built_rows=self.built_rows, **extra)
+        os.replace(tmp_path, self.path)
+
+    def build(self, matrix, generation=None):
+        """Полное построение индекса по всем строкам матрицы."""
+        self.generation = generation
+        clusters = max(1, int(np.sqrt(len(matrix))))
+        self.centroids, self.assignments = kmeans(np.asarray(matrix, dtype=np.float32), clusters)
+        self.built_rows = len(matrix)
+        logging.info(f"Built encoding index: {len(matrix)} rows, {clusters} clusters.")
+
+    def update(self, store):
+        """Привести индекс в соответствие с хранилищем; возвращает True, если индекс изменился."""
+        matrix = store.matrix
+        indexed = len(self.assignments)
+        if self.centroids is None or store.generation != self.generation or len(matrix) < indexed \
+                or len(matrix) > self.built_rows * self.rebuild_factor:
+            if not len(matrix):
+                return False
+            self.build(matrix, store.generation)
+        elif len(matrix) > indexed:
+            # Новые строки добавляются в ближайшие существующие кластеры
+            new_rows = np.asarray(matrix[indexed:], dtype=np.float32)
+            new_assignments = np.argmin(squared_distances(new_rows, self.centroids), axis=1).astype(np.int32)
+            self.assignments = np.concatenate([self.assignments, new_assignments])
+            logging.info(f"Added {len(new_rows)} rows to the encoding index.")
+        else:
+            return False
+        self.save()
+        return True
+
+    def probe(self, queries, n_probe):
+        """Номера n_probe ближайших кластеров для каждого запроса."""
+        distances = squared_distances(queries, self.centroids)
+        n_probe = min(n_probe, len(self.centroids))
+        return np.argpartition(distances, n_probe - 1, axis=1)[:, :n_probe]
+
+
+def open_index(store):
+    """Загрузить индекс хранилища и дополнить его новыми строками.
+
+    Обновление идёт под блокировкой хранилища: параллельно запущенные процессы
+    не строят индекс одновременно, а загружают уже сохранённый первым из них.
+    """
+    with store.locked():
+        index = FaceIndex(store.folder).load()
+        index.update(store)
+    return index
+
+
+def gallery_index(store, names, min_index_size=MIN_INDEX_SIZE, update=True):
+    """Индекс для галереи выбранных лиц или None, если хватит полного перебора.
+
+    Маленькой галерее индекс не нужен, и он не строится. При update=False индекс
+    только читается (рабочие процессы пакетной обработки): устаревший индекс не
+    используется, и поиск идёт полным перебором.
+    """
+    if sum(len(store.rows(name)) for name in names) < min_index_size:
+        return None
+    if update:
+        return open_index(store)
+    index = FaceIndex(store.folder).load()
+    return index if index.is_current(store) else None
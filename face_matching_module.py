@@ -0,0 +1,115 @@
+import numpy as np
+
+ENCODING_SIZE = 128  # Размер кодировки dlib
+MIN_INDEX_SIZE = 2000  # С меньшей галереей полный перебор быстрее поиска по индексу
+
+
+class ReferenceMatcher:
+    """Сопоставление найденных лиц с галереей референсных кодировок.
+
+    Галерея хранится одной непрерывной матрицей float32, а расстояния от всех лиц
+    до всех референсов считаются одним матричным умножением. Для больших галерей
+    можно передать FaceIndex: галерея упорядочивается по кластерам, и расстояния
+    считаются только до кодировок из n_probe ближайших к лицу кластеров.
+    Приближённый поиск может только завысить расстояние: лицо референса,
+    оказавшееся за порогом, будет размыто, а если так пропущены все совпадения,
+    изображение пропускается как не содержащее референсного лица.
+    """
+
+    def __init__(self, face_encodings, names=None, index=None, n_probe=8, min_index_size=MIN_INDEX_SIZE):
+        self.names = list(face_encodings) if names is None else list(names)
+        blocks = []
+        labels = []
+        row_ids = []
+        for label, name in enumerate(self.names):
+            encodings = np.asarray(face_encodings.get(name, []), dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            blocks.append(encodings)
+            labels.append(np.full(len(encodings), label, dtype=np.int32))
+            if index is not None:
+                row_ids.append(np.asarray(face_encodings.rows(name), dtype=np.int64))
+
+        if blocks:
+            self.gallery = np.ascontiguousarray(np.concatenate(blocks))
+            self.labels = np.concatenate(labels)
+        else:
+            self.gallery = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+            self.labels = np.empty(0, dtype=np.int32)
+        self._gallery_sq_norms = np.einsum('ij,ij->i', self.gallery, self.gallery)
+
+        self.index = index if index is not None and len(self.gallery) >= min_index_size else None
+        self.n_probe = n_probe
+        if self.index is not None:
+            # Инвертированные списки: строки галереи одного кластера идут подряд,
+            # список кластера c — срез list_offsets[c]:list_offsets[c + 1]
+            clusters = self.index.assignments[np.concatenate(row_ids)]
+            order = np.argsort(clusters, kind='stable')
+            self.gallery = np.ascontiguousarray(self.gallery[order])
+            self.labels = self.labels[order]
+            self._gallery_sq_norms = self._gallery_sq_norms[order]
+            self.list_offsets = np.searchsorted(clusters[order], np.arange(len(self.index.centroids) + 1))
+
+    def __len__(self):
+        return len(self.gallery)
+
+    def distances(self, encodings, rows=slice(None)):
+        """Матрица евклидовых расстояний (лица x референсы); rows — срез галереи."""
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        squared = (np.einsum('ij,ij->i', queries, queries)[:, None]
+                   + self._gallery_sq_norms[None, rows]
+                   - 2.0 * queries @ self.gallery[rows].T)
+        np.maximum(squared, 0.0, out=squared)  # Защита от отрицательных значений из-за округления
+        return np.sqrt(squared, out=squared)
+
+    def match(self, encodings):
+        """Лучшее совпадение для каждого лица.
+
+        Возвращает список имён (None, если галерея пуста) и массив расстояний.
+        """
+        count = len(encodings)
+        if count == 0 or len(self) == 0:
+            return [None] * count, np.full(count, np.inf, dtype=np.float32)
+
+        if self.index is not None:
+            best, best_distances = self._match_indexed(encodings)
+        else:
+            distances = self.distances(encodings)
+            best = np.argmin(distances, axis=1)
+            best_distances = distances[np.arange(count), best]
+        identities = [self.names[label] for label in self.labels[best]]
+        return identities, best_distances
+
+    def _match_indexed(self, encodings):
+        """Поиск только среди кодировок из ближайших кластеров индекса.
+
+        Запросы группируются по кластерам: для каждого кластера, который
+        проверяет хотя бы одно лицо, считается одно умножение матриц по срезу галереи.
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        count = len(queries)
+        query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+        best = np.full(count, -1, dtype=np.int64)
+        best_squared = np.full(count, np.inf, dtype=np.float32)
+
+        probes = self.index.probe(queries, self.n_probe)
+        pair_clusters = probes.ravel()
+        pair_queries = np.repeat(np.arange(count), probes.shape[1])
+        order = np.argsort(pair_clusters, kind='stable')
+        clusters, starts = np.unique(pair_clusters[order], return_index=True)
+        for cluster, query_ids in zip(clusters, np.split(pair_queries[order], starts[1:])):
+            start, end = self.list_offsets[cluster], self.list_offsets[cluster + 1]
+            if start == end:
+                continue
+            squared = (query_sq_norms[query_ids, None] + self._gallery_sq_norms[None, start:end]
+                       - 2.0 * queries[query_ids] @ self.gallery[start:end].T)
+            nearest = np.argmin(squared, axis=1)
+            nearest_squared = squared[np.arange(len(query_ids)), nearest]
+            better = nearest_squared < best_squared[query_ids]
+            best_squared[query_ids[better]] = nearest_squared[better]
+            best[query_ids[better]] = start + nearest[better]
+
+        missing = np.flatnonzero(best < 0)  # В ближайших кластерах нет выбранных лиц
+        if len(missing):
+            distances = self.distances(queries[missing])
+            best[missing] = np.argmin(distances, axis=1)
+            best_squared[missing] = distances[np.arange(len(missing)), best[missing]] ** 2
+        return best, np.sqrt(np.maximum(best_squared, 0.0))
@@ -1,11 +1,20 @@
+import multiprocessing
 import os
+import queue
 import tkinter as tk
+from concurrent.futures import ProcessPoolExecutor
 from tkinter import filedialog, simpledialog, ttk
-import cv2
-import face_recognition
 import pickle
 from PIL import Image, ImageTk
 
+from face_writer_module import open_writer
+from lazy_import_module import lazy_import
+from metrics_module import REGISTRY
+
+# Heavy backends are imported on first use so the window opens immediately
+cv2 = lazy_import('cv2')
+face_recognition = lazy_import('face_recognition')
+
 
 class Logger:
     """Simple logger class to handle logging messages."""
@@ -19,39 +28,168 @@ class Logger:
 
 
 class Face:
-    """Class to represent a detected face and its operations."""
-
-    def __init__(self, image, location):
-        self.image = image
-        self.location = location
-
-    def save(self, face_name, output_dir):
-        """Save detected face in the specified directory."""
+    """Class to represent a detected face and its operations.
+
+    Only a padded crop around the face and a small thumbnail are kept in memory,
+    never the full source image. Without a crop the face is re-read from the
+    source file when it is saved.
+    """
+
+    def __init__(self, source_path, location, crop=None, crop_origin=(0, 0), thumbnail=None):
+        self.source_path = source_path
+        self.location = location  # (top, right, bottom, left) in the source image
+        self.crop = crop  # BGR pixels around the face, or None
+        self.crop_origin = crop_origin  # (top, left) of the crop in the source image
+        self.thumbnail = thumbnail  # RGB preview for the selection grid
+
+    def face_image(self):
+        """BGR pixels of the face, taken from the crop or lazily from the source file."""
         top, right, bottom, left = self.location
-        face_img = self.image[top:bottom, left:right]
-
-        # Generate unique file name
-        face_files = [f for f in os.listdir(output_dir) if f.startswith(face_name)]
-
-        # Get the highest number used in existing files
-        face_numbers = [int(f.split('_')[-1].split('.')[0]) for f in face_files if f.endswith('.jpg')]
-        face_number = max(face_numbers) + 1 if face_numbers else 0  # Start from current max or 0
-
-        # Create file path with unique number
-        file_path = os.path.join(output_dir, f"{face_name}_{face_number}.jpg")
-        cv2.imwrite(file_path, face_img)
-        return file_path
+        if self.crop is not None:
+            crop_top, crop_left = self.crop_origin
+            return self.crop[top - crop_top:bottom - crop_top, left - crop_left:right - crop_left]
+        img_original = cv2.imread(self.source_path)
+        if img_original is None:
+            raise ValueError(f"Cannot read image {self.source_path}")
+        return img_original[top:bottom, left:right].copy()
+
+    def save(self, face_name, output_dir, writer=None):
+        """Save detected face in the specified directory.
+
+        Returns the saved path, or None if a near-duplicate is already stored.
+        Without a writer, the shared writer for output_dir is used.
+        """
+        writer = writer or open_writer(output_dir, face_name)
+        if not writer.add(self.face_image()):
+            return None
+        saved = writer.flush()
+        return saved[-1] if saved else None
+
+
+THUMBNAIL_SIZE = 100
+CROP_PADDING = 0.25  # Margin kept around each face crop, relative to the face size
+FLUSH_DELAY_MS = 1000  # Selected faces are written in one batch after this pause
+
+
+def detect_faces_in_file(image_path, keep_crops=True):
+    """Worker process: find faces in an image and return only small per-face data.
+
+    The decoded image never leaves the worker; each face is returned as its
+    location, a 100x100 RGB thumbnail and, if keep_crops is set, a padded BGR crop.
+    """
+    img_original = cv2.imread(image_path)
+    if img_original is None:
+        raise ValueError(f"Cannot read image {image_path}")
+    img_rgb = cv2.cvtColor(img_original, cv2.COLOR_BGR2RGB)
+    height, width = img_rgb.shape[:2]
+
+    faces = []
+    for top, right, bottom, left in face_recognition.face_locations(img_rgb):
+        thumbnail = cv2.resize(img_rgb[top:bottom, left:right], (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        crop, crop_origin = None, (0, 0)
+        if keep_crops:
+            pad = int(max(bottom - top, right - left) * CROP_PADDING)
+            crop_top, crop_left = max(0, top - pad), max(0, left - pad)
+            crop = img_original[crop_top:min(height, bottom + pad), crop_left:min(width, right + pad)].copy()
+            crop_origin = (crop_top, crop_left)
+        faces.append(((top, right, bottom, left), crop, crop_origin, thumbnail))
+    return faces
+
+
+class ThumbnailGrid:
+    """Scrollable grid of face thumbnails.
+
+    Only the rows currently in view get canvas items and PhotoImages, so the
+    cost of scrolling and adding faces does not grow with the number of faces.
+    """
+
+    def __init__(self, master, on_select, cell_size=THUMBNAIL_SIZE + 6, height=330):
+        self.on_select = on_select
+        self.cell_size = cell_size
+        self.faces = []
+        self.rendered = {}  # Face index -> (canvas item, PhotoImage)
+
+        self.frame = ttk.Frame(master)
+        self.canvas = tk.Canvas(self.frame, height=height, highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.scroll)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.bind("<Configure>", lambda event: self.relayout())
+        self.canvas.bind("<MouseWheel>", lambda event: self.scroll("scroll", -event.delta // 120, "units"))
+        self.canvas.bind("<Button-4>", lambda event: self.scroll("scroll", -1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll("scroll", 1, "units"))
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def columns(self):
+        return max(1, self.canvas.winfo_width() // self.cell_size)
+
+    def add(self, face):
+        """Append a face; only its cell is drawn, existing thumbnails are kept."""
+        self.faces.append(face)
+        self.update_scrollregion()
+        self.render()
+
+    def clear(self):
+        self.canvas.delete("all")
+        self.rendered.clear()
+        self.faces.clear()
+        self.update_scrollregion()
+
+    def scroll(self, *args):
+        self.canvas.yview(*args)
+        self.render()
+
+    def update_scrollregion(self):
+        rows = -(-len(self.faces) // self.columns())
+        self.canvas.configure(scrollregion=(0, 0, self.columns() * self.cell_size, rows * self.cell_size),
+                              yscrollincrement=self.cell_size)
+
+    def relayout(self):
+        """Column count changed: redraw the visible cells at their new positions."""
+        self.canvas.delete("all")
+        self.rendered.clear()
+        self.update_scrollregion()
+        self.render()
+
+    def render(self):
+        """Create items for visible rows and drop the ones scrolled out of view."""
+        columns = self.columns()
+        top = self.canvas.canvasy(0)
+        first_row = max(0, int(top // self.cell_size) - 1)
+        last_row = int((top + self.canvas.winfo_height()) // self.cell_size) + 1
+        visible = range(first_row * columns, min(len(self.faces), (last_row + 1) * columns))
+
+        for idx in [idx for idx in self.rendered if idx not in visible]:
+            self.canvas.delete(self.rendered.pop(idx)[0])
+
+        for idx in visible:
+            if idx in self.rendered:
+                continue
+            face = self.faces[idx]
+            photo = ImageTk.PhotoImage(Image.fromarray(face.thumbnail))
+            row, column = divmod(idx, columns)
+            item = self.canvas.create_image(column * self.cell_size + 3, row * self.cell_size + 3,
+                                            image=photo, anchor="nw")
+            self.canvas.tag_bind(item, "<Button-1>", lambda event, f=face: self.on_select(f))
+            self.rendered[idx] = (item, photo)  # Keep a reference to the image
 
 
 class FaceSelectionApp:
-    def __init__(self, master):
+    def __init__(self, master, workers=None, keep_crops=True):
         self.master = master
         master.title("Face Selection")
 
-        self.img_originals = []  # List to store original images
         self.faces = []  # List to store detected faces
-        self.thumbnail_buttons = []  # Buttons for face previews
-        self.face_images = []  # Initialize face_images list
+        self.workers = workers
+        self.keep_crops = keep_crops  # False: keep only thumbnails and re-read sources on save
+        self.executor = None  # Detection pool, created on first upload
+        self.results = queue.Queue()  # Finished detections for the Tk thread
+        self.pending = 0
+        self.writers = {}  # Face store writer per output directory
+        self.flush_scheduled = False
 
         # Create a text field for logs
         self.log_text = tk.Text(master, height=10, width=70)
@@ -77,12 +215,17 @@ class FaceSelectionApp:
         self.clear_button = tk.Button(self.frame_buttons, text="Clear Selection", command=self.clear_selection)
         self.clear_button.pack(side="left", padx=5)
 
+        # Scrollable grid with face previews
+        self.thumbnail_grid = ThumbnailGrid(master, self.save_selected_face)
+        self.thumbnail_grid.pack(fill="both", expand=True)
+
+        master.protocol("WM_DELETE_WINDOW", self.close)
+
     def clear_selection(self):
         """Clear the selected faces and reset the application state."""
         self.logger.log("Clearing selections.")
         self.faces.clear()
-        self.img_originals.clear()
-        self.thumbnail_buttons.clear()
+        self.thumbnail_grid.clear()
         self.logger.log("Selections cleared.")
 
     def upload_images(self):
@@ -103,76 +246,46 @@ class FaceSelectionApp:
             self.logger.log("No images were selected.")
 
     def process_image(self, image_path):
-        """Process each uploaded image."""
-        self.logger.log(f"Processing image: {image_path}")
-        try:
-            img_original = cv2.imread(image_path)
-            img_rgb = cv2.cvtColor(img_original, cv2.COLOR_BGR2RGB)
-
-            # Find all faces in the image
-            face_locations = face_recognition.face_locations(img_rgb)
-            self.logger.log(f"Found {len(face_locations)} faces in {image_path}.")
-
-            if face_locations:
-                self.img_originals.append(img_original)  # Save the original image
-                for loc in face_locations:
-                    self.faces.append(Face(img_original, loc))  # Save each detected face
-
-                self.show_face_thumbnails()
-            else:
-                self.logger.log(f"No faces found in {image_path}.")
-        except Exception as e:
-            self.logger.log(f"Error processing image {image_path}: {str(e)}")
-
-    def show_face_thumbnails(self):
-        """Display face thumbnails for selection."""
-        self.logger.log("Entering show_face_thumbnails method.")
-
-        # Remove old buttons and reset lists
-        self.logger.log(f"Removing {len(self.thumbnail_buttons)} old buttons (if any).")
-        for btn in self.thumbnail_buttons:
-            btn.destroy()
-        self.thumbnail_buttons = []
-        self.face_images.clear()  # Clear the list of images
-
-        if not self.faces:
-            self.logger.log("No faces detected to display thumbnails.")
-            return
-
-        self.logger.log(f"Preparing to display {len(self.faces)} faces.")
-
-        for idx, face in enumerate(self.faces):
+        """Queue an image for face detection in the worker pool."""
+        if self.executor is None:
+            # The launcher imports heavy modules in a background thread; forking mid-import can hang the workers
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context(start_method))
+        future = self.executor.submit(detect_faces_in_file, image_path, self.keep_crops)
+        # The callback runs on an executor thread, so it only hands the result over to Tk
+        future.add_done_callback(lambda f, path=image_path: self.results.put((path, f)))
+        if self.pending == 0:
+            self.master.after(50, self.poll_results)
+        self.pending += 1
+
+    def poll_results(self):
+        """Collect finished detections and add their thumbnails without blocking the UI."""
+        while True:
             try:
-                self.logger.log(f"Processing face {idx + 1}/{len(self.faces)}.")
-
-                top, right, bottom, left = face.location
-                self.logger.log(f"Face {idx + 1} location: top={top}, right={right}, bottom={bottom}, left={left}.")
-
-                # Crop the face image
-                face_img = face.image[top:bottom, left:right]
-                self.logger.log(f"Face {idx + 1} image cropped successfully.")
-
-                # Resize for preview
-                face_img_resized = cv2.resize(face_img, (100, 100))
-                self.logger.log(f"Face {idx + 1} resized to 100x100.")
-
-                # Convert image for Tkinter
-                face_img_pil = Image.fromarray(cv2.cvtColor(face_img_resized, cv2.COLOR_BGR2RGB))
-                face_img_tk = ImageTk.PhotoImage(face_img_pil)
-
-                # Save the image in the list
-                self.face_images.append(face_img_tk)  # Store the reference
-                self.logger.log(f"Face {idx + 1} thumbnail created and added to memory.")
-
-                # Create a button with the face image
-                btn = tk.Button(self.master, image=face_img_tk,
-                                command=lambda f=face: self.save_selected_face(f))
-                btn.image = face_img_tk  # Keep a reference to the image
-                btn.pack(side="left")
-                self.thumbnail_buttons.append(btn)
-                self.logger.log(f"Button for face {idx + 1} created successfully and packed.")
+                image_path, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            try:
+                detected = future.result()
             except Exception as e:
-                self.logger.log(f"Error while processing face {idx + 1}: {str(e)}")
+                REGISTRY.inc('selection_errors')
+                self.logger.log(f"Error processing image {image_path}: {str(e)}")
+                continue
+
+            REGISTRY.inc('selection_images')
+            REGISTRY.inc('selection_faces', len(detected))
+            self.logger.log(f"Found {len(detected)} faces in {image_path}.")
+            for loc, crop, crop_origin, thumbnail in detected:
+                face = Face(image_path, loc, crop, crop_origin, thumbnail)
+                self.faces.append(face)  # Save each detected face
+                self.thumbnail_grid.add(face)
+
+        if self.pending:
+            self.master.after(50, self.poll_results)
+        else:
+            self.logger.log(f"All images processed, {len(self.thumbnail_grid.faces)} faces shown.")
 
     def save_selected_face(self, face):
         """Save the selected face image."""
@@ -180,20 +293,53 @@ class FaceSelectionApp:
             self.logger.log("Model name is not set.")
             return
 
-        output_dir = os.path.join("faces", self.model_name)
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            self.logger.log(f"Created directory for {self.model_name}.")
-
         try:
-            saved_path = face.save(self.model_name, output_dir)
-            self.logger.log(f"Face saved as {saved_path}.")
+            writer = self.face_writer(self.model_name)
+            with REGISTRY.timer('selection_save'):
+                queued = writer.add(face.face_image())
         except Exception as e:
             self.logger.log(f"Error saving face: {str(e)}")
+            return
+
+        if queued:
+            REGISTRY.inc('selection_saved')
+            # Crops are written in batches shortly after the last click
+            if not self.flush_scheduled:
+                self.flush_scheduled = True
+                self.master.after(FLUSH_DELAY_MS, self.flush_writers)
+        else:
+            REGISTRY.inc('selection_duplicates')
+            self.logger.log("Skipped a face that is nearly identical to one already saved.")
 
         # Clear faces after saving
         self.faces.clear()
-        self.img_originals.clear()
+
+    def face_writer(self, model_name):
+        """Writer for faces/<model_name>, opened once per directory."""
+        output_dir = os.path.join("faces", model_name)
+        writer = self.writers.get(output_dir)
+        if writer is None:
+            if not os.path.exists(output_dir):
+                self.logger.log(f"Created directory for {model_name}.")
+            writer = self.writers[output_dir] = open_writer(output_dir, model_name)
+        return writer
+
+    def flush_writers(self):
+        """Write all queued face crops to disk."""
+        self.flush_scheduled = False
+        for writer in self.writers.values():
+            try:
+                for saved_path in writer.flush():
+                    self.logger.log(f"Face saved as {saved_path}.")
+            except Exception as e:
+                self.logger.log(f"Error saving face: {str(e)}")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.flush_writers()
+        self.master.destroy()
 
 def run(master):
     app = FaceSelectionApp(master)
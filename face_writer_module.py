@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+from lazy_import_module import lazy_import
+
+cv2 = lazy_import('cv2')
+
+STATE_FILE = '.face_store.json'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def difference_hash(image):
+    """Перцептивный dHash (64 бита) изображения BGR: знаки разностей соседних пикселей уменьшенной копии."""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distances(hashes, value):
+    """Число различающихся битов между value и каждым хэшем массива."""
+    if not len(hashes):
+        return np.empty(0, dtype=np.int64)
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8)).reshape(len(hashes), 64).sum(axis=1)
+
+
+class FaceStoreWriter:
+    """Запись вырезанных лиц в каталог faces/<имя>/.
+
+    Следующий номер файла и dHash всех лиц каталога хранятся в STATE_FILE,
+    поэтому каталог просматривается один раз при открытии, а не при каждом
+    сохранении. Лица копятся в пакет и записываются в flush: каждый файл
+    пишется во временный и публикуется жёсткой ссылкой, которая не
+    перезаписывает существующий файл, — при занятом номере берётся следующий.
+    Лица, отличающиеся от уже сохранённых не больше чем на max_distance бит
+    dHash, пропускаются.
+    """
+
+    def __init__(self, output_dir, face_name, max_distance=6, batch_size=16, quality=95):
+        self.output_dir = output_dir
+        self.face_name = face_name
+        self.state_path = os.path.join(output_dir, STATE_FILE)
+        self.max_distance = max_distance
+        self.batch_size = batch_size
+        self.quality = quality
+        self.next_index = 0
+        self.hashes = {}  # Имя файла -> dHash
+        self.pending = []  # (dHash, лицо BGR) ещё не записанных лиц
+        self._hash_array = np.empty(0, dtype=np.uint64)
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        state = {}
+        if os.path.isfile(self.state_path):
+            try:
+                with open(self.state_path, 'r') as state_file:
+                    state = json.load(state_file)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable face store state {self.state_path}: {e}")
+        known = {file_name: int(value, 16) for file_name, value in state.get('hashes', {}).items()}
+
+        # Сверка с каталогом: файлы могли добавить или удалить вручную
+        pattern = re.compile(rf"^{re.escape(self.face_name)}_(\d+)\.")
+        next_index = state.get('next_index', 0)
+        for entry in os.scandir(self.output_dir):
+            if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            match = pattern.match(entry.name)
+            if match:
+                next_index = max(next_index, int(match.group(1)) + 1)
+            if entry.name in known:
+                self.hashes[entry.name] = known[entry.name]
+                continue
+            image = cv2.imread(entry.path)
+            if image is not None:
+                self.hashes[entry.name] = difference_hash(image)
+        self.next_index = next_index
+        self._hash_array = np.array(list(self.hashes.values()), dtype=np.uint64)
+        if self.hashes.keys() != known.keys():
+            self._save_state()
+
+    def _save_state(self):
+        state = {'next_index': self.next_index,
+                 'hashes': {file_name: f"{value:016x}" for file_name, value in sorted(self.hashes.items())}}
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def _is_duplicate(self, face_hash):
+        pending = np.array([value for value, _ in self.pending], dtype=np.uint64)
+        distances = hamming_distances(np.concatenate([self._hash_array, pending]), face_hash)
+        return bool(len(distances)) and int(distances.min()) <= self.max_distance
+
+    def add(self, face_img):
+        """Добавление лица в пакет; возвращает False, если похожее лицо уже сохранено или ждёт записи."""
+        face_hash = difference_hash(face_img)
+        with self._lock:
+            if self._is_duplicate(face_hash):
+                return False
+            self.pending.append((face_hash, np.ascontiguousarray(face_img)))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+        return True
+
+    def _publish(self, data):
+        """Атомарная запись файла под следующим свободным номером."""
+        tmp_path = os.path.join(self.output_dir, f".{self.face_name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as face_file:
+            face_file.write(data)
+        try:
+            while True:
+                file_name = f"{self.face_name}_{self.next_index}.jpg"
+                self.next_index += 1
+                try:
+                    os.link(tmp_path, os.path.join(self.output_dir, file_name))  # Не перезаписывает существующий файл
+                    return file_name
+                except FileExistsError:
+                    continue  # Номер занял другой процесс
+        finally:
+            os.remove(tmp_path)
+
+    def flush(self):
+        """Запись накопленных лиц; возвращает пути сохранённых файлов."""
+        with self._lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return []
+            saved = []
+            for face_hash, face_img in batch:
+                ok, encoded = cv2.imencode('.jpg', face_img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if not ok:
+                    logging.error(f"Cannot encode a face crop for {self.face_name}.")
+                    continue
+                file_name = self._publish(encoded.tobytes())
+                self.hashes[file_name] = face_hash
+                saved.append(os.path.join(self.output_dir, file_name))
+            self._hash_array = np.array(list(self.hashes.values()), dtype=np.uint64)
+            self._save_state()  # Одна запись состояния на пакет
+        return saved
+
+
+_writers = {}  # (каталог, имя) -> FaceStoreWriter, общий для всего процесса
+_writers_lock = threading.Lock()
+
+
+def open_writer(output_dir, face_name):
+    """Общий FaceStoreWriter каталога: каталог просматривается один раз за процесс."""
+    key = (os.path.abspath(output_dir), face_name)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = FaceStoreWriter(output_dir, face_name)
+        return writer
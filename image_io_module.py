@@ -0,0 +1,68 @@
+import logging
+
+import numpy as np
+from PIL import Image
+
+from lazy_import_module import lazy_import
+
+cv2 = lazy_import('cv2')
+
+EXIF_IFD = 0x8769
+MAKER_NOTE = 0x927C
+
+
+def read_image(source, max_size=None):
+    """Декодирование изображения в массив RGB uint8 (H, W, 3).
+
+    Это единственный формат изображения в пайплайне: детекция, кодирование и
+    размытие работают с ним без перестановки каналов. Если длинная сторона
+    больше max_size, JPEG сразу декодируется в уменьшенном разрешении (1/2,
+    1/4 или 1/8), а остаток масштаба доводится resize.
+    """
+    with Image.open(source) as image:
+        target = None
+        width, height = image.size
+        if max_size and max(width, height) > max_size:
+            scale = max_size / max(width, height)
+            target = (int(width * scale), int(height * scale))
+            image.draft('RGB', target)  # Для остальных форматов не действует
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        pixels = np.array(image)  # Единственная копия кадра, массив доступен для записи
+
+    if target is not None and (pixels.shape[1], pixels.shape[0]) != target:
+        pixels = cv2.resize(pixels, target)
+    if target is not None:
+        logging.info(f"Image resized to {target}.")
+    return pixels
+
+
+def read_metadata(source):
+    """EXIF и ICC-профиль исходного файла; читается только заголовок.
+
+    EXIF собирается заново из IFD0 и вложенных каталогов: IFD1 со встроенной
+    миниатюрой и MakerNote (в нём производители хранят превью) в результат не
+    попадают — иначе неразмытая копия снимка осталась бы в выходном файле.
+    """
+    with Image.open(source) as image:
+        metadata = {}
+        if image.info.get('icc_profile'):
+            metadata['icc_profile'] = image.info['icc_profile']
+        exif = image.getexif()
+        if exif:
+            exif.get_ifd(EXIF_IFD).pop(MAKER_NOTE, None)  # Вложенный каталог кэшируется и попадает в tobytes
+            metadata['exif'] = exif.tobytes()
+        return metadata
+
+
+def write_image(pixels, destination, image_format=None, quality=90, metadata=None):
+    """Сохранение массива RGB; destination — путь или файловый объект (тогда нужен image_format).
+
+    Метаданные из read_metadata записываются как есть: пиксели не поворачиваются,
+    поэтому тег ориентации EXIF остаётся верным.
+    """
+    options = dict(metadata or {})
+    if quality:
+        options['quality'] = quality  # Учитывается JPEG и WebP, остальные форматы его игнорируют
+    Image.fromarray(pixels).save(destination, format=image_format, **options)
+    return destination
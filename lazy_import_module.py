@@ -0,0 +1,55 @@
+import importlib
+import logging
+import sys
+import time
+
+IMPORT_TIMES = {}  # Время импорта тяжёлых модулей, в секундах
+
+
+class LazyModule:
+    """Модуль, импортируемый при первом обращении к атрибуту."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = timed_import(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+
+def timed_import(name):
+    """Импорт модуля с записью времени импорта.
+
+    Всегда идёт через importlib: если модуль в это время импортирует другой
+    поток (прогрев лаунчера), вызов дождётся конца импорта, а не вернёт
+    недоинициализированный модуль из sys.modules.
+    """
+    loaded = name in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    if loaded:
+        return module
+    IMPORT_TIMES[name] = time.perf_counter() - start
+    logging.info(f"Imported {name} in {IMPORT_TIMES[name]:.2f}s.")
+    return module
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def import_report():
+    """Отчёт о времени импорта тяжёлых модулей."""
+    return '\n'.join(f"{name}: {seconds:.2f}s"
+                     for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]))
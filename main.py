@@ -1,9 +1,15 @@
+import time
+
+START_TIME = time.perf_counter()
+
+import logging
 import os
+import threading
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import ttk
 
-import photo_processing_module
+from lazy_import_module import import_report, timed_import
 
 
 def launch_face_selection():
@@ -21,6 +27,7 @@ def launch_face_selection():
 def launch_photo_processing():
     """Function to launch the Photo Processing App."""
     try:
+        import photo_processing_module  # Импортируем модуль обработки фото при первом использовании
         photo_processing_module.run_photo_processing()  # Запускаем функцию обработки фото
     except ImportError:
         messagebox.showerror("Error", "Photo processing module not found.")
@@ -40,6 +47,26 @@ def launch_train_model():
         messagebox.showerror("Error", str(e))
 
 
+def warm_up():
+    """Background preload of the heavy models while the launcher is idle."""
+    start = time.perf_counter()
+    try:
+        photo_processing_module = timed_import('photo_processing_module')
+        photo_processing_module.warm_up()
+        logging.info(f"Models warmed up in {time.perf_counter() - start:.2f}s.")
+    except Exception as e:
+        logging.warning(f"Model warm-up failed: {e}")
+    report = import_report()
+    if report:
+        logging.info(f"Import times:\n{report}")
+
+
+def report_startup():
+    """Log time to first window and start the background warm-up."""
+    logging.info(f"Time to first window: {time.perf_counter() - START_TIME:.2f}s.")
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
 class MainApp:
     def __init__(self, master):
         self.master = master
@@ -69,6 +96,8 @@ class MainApp:
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     root = tk.Tk()
     app = MainApp(root)
+    root.after_idle(report_startup)
     root.mainloop()
@@ -0,0 +1,175 @@
+import cProfile
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Распределение значений с фиксированными границами корзин."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+
+class JsonLinesSink:
+    """Запись событий в файл JSON Lines."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str) + '\n'
+        with self._lock, open(self.path, 'a') as sink_file:
+            sink_file.write(line)
+
+
+class LoggingSink:
+    """Вывод событий в журнал logging на уровне DEBUG."""
+
+    def __call__(self, event):
+        logging.debug(json.dumps(event, default=str))
+
+
+class MetricsRegistry:
+    """Счётчики, таймеры этапов и события в процессе.
+
+    Таймеры и распределения хранятся как гистограммы, события (например, итог
+    обработки изображения) передаются в подключённые приёмники. Состояние можно
+    выгрузить в текстовом формате Prometheus.
+    """
+
+    def __init__(self, prefix='blurimage'):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.sinks = []
+        self.profile_dir = None
+        self.profile_every = 0
+        self._profiled = 0
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage, record=None):
+        """Замер этапа: время попадает в гистограмму <stage>_seconds и, если задано, в словарь record."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(f"{stage}_seconds", elapsed)
+            if record is not None:
+                record[stage] = record.get(stage, 0.0) + elapsed
+
+    def emit(self, event, **fields):
+        """Передача события всем приёмникам."""
+        if not self.sinks:
+            return
+        record = dict(fields, event=event, time=time.time())
+        for sink in self.sinks:
+            try:
+                sink(record)
+            except Exception as e:
+                logging.warning(f"Metrics sink failed: {e}")
+
+    def configure_profiling(self, profile_dir, every=1):
+        """Включение cProfile для каждого every-го изображения; результаты сохраняются в profile_dir."""
+        self.profile_dir = profile_dir
+        self.profile_every = every
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def profile(self, name):
+        """Профилирование блока, если профилирование включено и подошла очередь."""
+        with self._lock:
+            self._profiled += 1
+            enabled = bool(self.profile_dir) and self.profile_every > 0 and self._profiled % self.profile_every == 0
+        if not enabled:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            safe_name = re.sub(r'[^\w.-]', '_', name)
+            path = os.path.join(self.profile_dir, f"{int(time.time() * 1000)}_{safe_name}.prof")
+            profiler.dump_stats(path)
+            logging.info(f"Profile saved to {path}.")
+
+    def hit_rate(self, name):
+        """Доля попаданий для пары счётчиков <name>_hits / <name>_misses."""
+        with self._lock:
+            return self._hit_rate(name)
+
+    def _hit_rate(self, name):
+        hits = self.counters.get(f"{name}_hits", 0)
+        total = hits + self.counters.get(f"{name}_misses", 0)
+        return hits / total if total else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: {'count': histogram.count, 'sum': histogram.total}
+                               for name, histogram in self.histograms.items()},
+            }
+
+    def to_prometheus(self):
+        """Состояние в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            # Для каждой пары <name>_hits / <name>_misses — доля попаданий
+            for name in sorted(name[:-len('_hits')] for name in self.counters if name.endswith('_hits')):
+                metric = f"{self.prefix}_{name}_hit_ratio"
+                lines += [f"# TYPE {metric} gauge", f"{metric} {self._hit_rate(name):.4f}"]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines += [f"{metric}_sum {histogram.total}", f"{metric}_count {histogram.count}"]
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()  # Общий реестр процесса
@@ -1,82 +1,219 @@
-import face_recognition
+import multiprocessing
 import os
-import json
+import queue
+import time
 import numpy as np
 import tkinter as tk
+from concurrent.futures import ProcessPoolExecutor
+
+from encoding_store_module import open_store
+from face_index_module import open_index
+from face_matching_module import MIN_INDEX_SIZE
+from lazy_import_module import lazy_import
+from metrics_module import REGISTRY
+
+face_recognition = lazy_import('face_recognition')  # Нужен только в рабочих процессах
+dlib = lazy_import('dlib')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+BATCH_SIZE = 16  # Количество изображений в одной задаче рабочего процесса
+
+
+# Выполняется в рабочем процессе: кодирование пачки изображений.
+# Изображения в faces/<имя>/ — уже вырезанные Face.save лица, поэтому при assume_cropped
+# всё изображение считается рамкой лица и повторная HOG-детекция не выполняется, а
+# кодировки всей пачки считаются одним вызовом dlib compute_face_descriptor.
+def encode_image_files(image_paths, assume_cropped=True):
+    if assume_cropped:
+        return encode_cropped_files(image_paths)
+    results = []
+    for image_path in image_paths:
+        start = time.perf_counter()
+        try:
+            image = face_recognition.load_image_file(image_path)
+            encodings = face_recognition.face_encodings(image)
+            results.append((encodings, None, time.perf_counter() - start))
+        except Exception as e:
+            results.append(([], str(e), time.perf_counter() - start))
+    return results
+
+
+def encode_cropped_files(image_paths):
+    results = [None] * len(image_paths)
+    images = []
+    batch_shapes = []
+    loaded = []  # (номер в пачке, время загрузки)
+    for i, image_path in enumerate(image_paths):
+        start = time.perf_counter()
+        try:
+            image = face_recognition.load_image_file(image_path)
+            height, width = image.shape[:2]
+            # Те же 5 точек лица, что использует face_recognition.face_encodings
+            landmarks = face_recognition.api._raw_face_landmarks(image, [(0, width, height, 0)], model='small')
+            shapes = dlib.full_object_detections()
+            shapes.append(landmarks[0])
+        except Exception as e:
+            results[i] = ([], str(e), time.perf_counter() - start)
+            continue
+        images.append(image)
+        batch_shapes.append(shapes)
+        loaded.append((i, time.perf_counter() - start))
+
+    if loaded:
+        start = time.perf_counter()
+        try:
+            descriptors = face_recognition.api.face_encoder.compute_face_descriptor(images, batch_shapes)
+            error = None
+        except Exception as e:
+            descriptors, error = [[]] * len(loaded), str(e)
+        share = (time.perf_counter() - start) / len(loaded)  # Время пакета делится поровну
+        for (i, elapsed), image_descriptors in zip(loaded, descriptors):
+            encodings = [np.array(descriptor) for descriptor in image_descriptors]
+            results[i] = (encodings, error, elapsed + share)
+    return results
+
+
+# Поиск новых, изменённых и удалённых изображений в папке лица
+def scan_folder(folder_path, known_files):
+    changed = {}
+    current = set()
+    for entry in os.scandir(folder_path):
+        if not entry.is_file() or not entry.name.endswith(IMAGE_EXTENSIONS):
+            continue
+        current.add(entry.name)
+        stat = entry.stat()
+        file_info = known_files.get(entry.name)
+        # Кодировки, перенесённые из JSON, не содержат mtime/size и считаются актуальными
+        if file_info is None or ('mtime' in file_info and
+                                 (file_info['mtime'], file_info['size']) != (stat.st_mtime, stat.st_size)):
+            changed[entry.name] = {'mtime': stat.st_mtime, 'size': stat.st_size}
+    deleted = [file_name for file_name in known_files if file_name not in current]
+    return changed, deleted
 
 
 class ModelTrainingApp:
-    def __init__(self, master, image_folder='faces'):
+    def __init__(self, master, image_folder='faces', workers=None, assume_cropped=True, metrics=None):
         self.image_folder = image_folder
+        self.workers = workers
+        self.assume_cropped = assume_cropped  # Изображения — готовые вырезки лиц
+        self.metrics = metrics or REGISTRY
         self.master = master
         self.master.title("Model Training App")
+        self.master.protocol("WM_DELETE_WINDOW", self.close)
 
         # Создаем текстовое поле для вывода сообщений
         self.text_output = tk.Text(master, wrap=tk.WORD, height=20, width=50)
         self.text_output.pack(pady=10)
 
+        self.store = None
+        self.executor = None
+        self.results = queue.Queue()  # Результаты рабочих процессов для потока Tk
+        self.pending = 0
+        self.added = 0
+        self.closed = False
+
         # Запускаем процесс обработки лиц
         self.process_all_faces()
 
-    # Функция для обработки всех папок и создания/обновления файлов с кодировками
+    def log(self, message):
+        self.text_output.insert(tk.END, message + '\n')
+        self.text_output.see(tk.END)
+
+    # Функция для поиска изменений во всех папках и запуска кодирования в пуле процессов
     def process_all_faces(self):
-        for folder_name in os.listdir(self.image_folder):
-            folder_path = os.path.join(self.image_folder, folder_name)
-
-            # Проверяем, является ли это папкой
-            if os.path.isdir(folder_path):
-                self.text_output.insert(tk.END, f"Processing folder: {folder_name}\n")
-                self.master.update()  # Обновляем окно для отображения изменений
-
-                # Правильный путь для JSON файла: внутри папки с именем лица
-                json_file_path = os.path.join(folder_path, f"{folder_name}.json")
-                encodings_dict = {'files': []}
-                save_required = False  # Флаг, чтобы отслеживать, нужно ли сохранять файл
-
-                # Если JSON файла нет, создаём его с новыми кодировками
-                if not os.path.isfile(json_file_path):
-                    self.text_output.insert(tk.END, f"No JSON file found for {folder_name}, creating new one.\n")
-                else:
-                    self.text_output.insert(tk.END, f"Loading known face encodings from {json_file_path}...\n")
-                    with open(json_file_path, 'r') as json_file:
-                        encodings_dict = json.load(json_file)
-
-                # Считываем все файлы изображений в папке
-                image_files = [f for f in os.listdir(folder_path) if f.endswith(('.png', '.jpg', '.jpeg'))]
-
-                # Обрабатываем изображения и добавляем кодировки
-                for filename in image_files:
-                    if not any(file_info['file_name'] == filename for file_info in encodings_dict['files']):
-                        image_path = os.path.join(folder_path, filename)
-                        self.text_output.insert(tk.END, f"Loading image: {image_path}\n")
-                        self.master.update()  # Обновляем окно
-
-                        try:
-                            image = face_recognition.load_image_file(image_path)
-                            encodings = face_recognition.face_encodings(image)
-                            for encoding in encodings:
-                                encodings_dict['files'].append({
-                                    "file_name": filename,
-                                    "encodings": encoding.tolist()  # Сохраняем кодировки в формате списка
-                                })
-                            self.text_output.insert(tk.END, f"Added {len(encodings)} encoding(s) for {filename}\n")
-                            save_required = True  # Устанавливаем флаг для сохранения
-                        except Exception as e:
-                            self.text_output.insert(tk.END, f"Error loading {filename}: {e}\n")
-
-                # Сохранение кодировок в JSON файл только при необходимости
-                if save_required:
-                    with open(json_file_path, 'w') as json_file:
-                        json.dump(encodings_dict, json_file, indent=4)
-                        self.text_output.insert(tk.END, f"Saved encodings to {json_file_path}\n")
-                else:
-                    self.text_output.insert(tk.END, f"No new encodings added for {folder_name}, skipping save.\n")
-
-                # Прокручиваем текстовое поле вниз
-                self.text_output.see(tk.END)
+        self.store = open_store(self.image_folder)
+        jobs = []
+        with self.metrics.timer('train_scan'):
+            for folder_name in sorted(os.listdir(self.image_folder)):
+                folder_path = os.path.join(self.image_folder, folder_name)
+
+                # Проверяем, является ли это папкой
+                if os.path.isdir(folder_path):
+                    changed, deleted = scan_folder(folder_path, self.store.files(folder_name))
+                    for filename in deleted:
+                        self.store.remove(folder_name, filename)
+                    self.metrics.inc('train_files_deleted', len(deleted))
+                    self.log(f"{folder_name}: {len(changed)} new or changed, {len(deleted)} deleted.")
+                    jobs.extend((folder_name, folder_path, filename, meta) for filename, meta in changed.items())
+
+            # Папку лица удалили целиком — удаляем и все его кодировки
+            for folder_name in self.store.identities():
+                if not os.path.isdir(os.path.join(self.image_folder, folder_name)):
+                    deleted = list(self.store.files(folder_name))
+                    for filename in deleted:
+                        self.store.remove(folder_name, filename)
+                    self.metrics.inc('train_files_deleted', len(deleted))
+                    self.log(f"{folder_name}: folder removed, {len(deleted)} files deleted.")
+
+        if not jobs:
+            self.finish()
+            return
+
+        self.pending = len(jobs)
+        # В лаунчере модели импортируются в фоновом потоке; fork посреди импорта может повесить процессы
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(start_method))
+        for start in range(0, len(jobs), BATCH_SIZE):
+            batch = [(folder_name, filename, meta) for folder_name, _, filename, meta in jobs[start:start + BATCH_SIZE]]
+            image_paths = [os.path.join(folder_path, filename) for _, folder_path, filename, _ in jobs[start:start + BATCH_SIZE]]
+            future = self.executor.submit(encode_image_files, image_paths, self.assume_cropped)
+            # Колбэк вызывается в служебном потоке, поэтому только кладём результат в очередь
+            future.add_done_callback(lambda f, batch=batch: self.results.put((batch, f)))
+        self.master.after(100, self.poll_results)
+
+    # Приём результатов в потоке Tk без блокировки окна
+    def poll_results(self):
+        if self.closed:
+            return
+        while True:
+            try:
+                batch, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= len(batch)
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [([], str(e), 0.0)] * len(batch)
+
+            for (folder_name, filename, meta), (encodings, error, elapsed) in zip(batch, results):
+                self.metrics.observe('train_encode_seconds', elapsed)
+                if error is not None:
+                    self.metrics.inc('train_errors')
+                    self.log(f"Error loading {folder_name}/{filename}: {error}")
+                    continue
+                with self.metrics.timer('train_store_write'):
+                    self.store.upsert(folder_name, filename, encodings, **meta)
+                self.metrics.inc('train_files_encoded')
+                self.metrics.inc('train_encodings_added', len(encodings))
+                self.added += len(encodings)
+                self.log(f"Added {len(encodings)} encoding(s) for {folder_name}/{filename}")
+
+        if self.pending:
+            self.master.after(100, self.poll_results)
+        else:
+            self.finish()
+
+    def finish(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.store.row_count >= MIN_INDEX_SIZE:  # Меньшей галерее индекс не понадобится
+            with self.metrics.timer('train_index_update'):
+                open_index(self.store)  # Дополняем индекс новыми строками
+        self.log(f"Done: saved {self.added} encodings to {self.store.data_path}")
 
         # Закрываем окно через 5 секунд
-        self.master.after(5000, self.master.destroy)
+        self.master.after(5000, self.close)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.master.destroy()
 
 
 def run(master):
@@ -1,36 +1,74 @@
 import os
 import tkinter as tk
 from tkinter import filedialog
-import face_recognition
-import json
-import cv2
+import threading
 import numpy as np
-from mtcnn import MTCNN
 import logging
-from PIL import Image
+
+from blur_engine_module import BlurEngine
+from encoding_store_module import open_store
+from face_detection_module import FaceDetector
+from face_index_module import gallery_index
+from face_matching_module import ReferenceMatcher
+from image_io_module import read_image, read_metadata, write_image
+from lazy_import_module import lazy_import, timed_import
+from metrics_module import REGISTRY
+
+# Тяжёлые модули (dlib, OpenCV) импортируются при первом использовании
+face_recognition = lazy_import('face_recognition')
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
+class ImageAnalysis:
+    """Результат анализа изображения, общий для всех этапов размытия."""
+
+    def __init__(self, face_boxes, face_locations, encodings):
+        self.face_boxes = face_boxes  # Результаты MTCNN
+        self.face_locations = face_locations  # Координаты (top, right, bottom, left)
+        self.landmarks = [box.get('keypoints') for box in face_boxes]
+        self.encodings = encodings  # 128-мерные кодировки dlib
+        self.identities = []  # Ближайшее референсное лицо для каждого лица
+        self.distances = []  # Минимальное расстояние до референсных лиц для каждого лица
+        self.reference_location = None
+
+
 class PhotoProcessingApp:
-    def __init__(self):
+    def __init__(self, detection_size=None, tile_size=None, tile_overlap=256, tile_workers=1, analysis_cache=None,
+                 metrics=None, use_index=True, small_faces=True):
         self.min_face_size = 5
         self.thresholds = 1.9
+        self.max_image_size = 5000  # Изображения больше этого размера уменьшаются (без режима плиток)
+        self.detection_size = detection_size  # Длинная сторона копии для детекции; None — полное разрешение
+        self.small_faces = small_faces  # При detection_size искать мелкие лица в полном разрешении
+        self.tile_size = tile_size  # Размер плитки для больших изображений; None — без плиток, с уменьшением до 5000px
+        self.tile_overlap = tile_overlap
+        self.tile_workers = tile_workers
+        self.match_threshold = 0.4  # Пороговое расстояние для совпадения с референсным лицом
+        self.jpeg_quality = 90  # Качество сохраняемых JPEG
+        self.preserve_metadata = True  # Перенос EXIF и ICC-профиля из исходного файла
+        self.analysis_cache = analysis_cache  # AnalysisCache или None
+        self.metrics = metrics or REGISTRY  # Таймеры этапов, счётчики и события
         self.selected_faces = None
         self.face_encodings = {}
-        self.detector = MTCNN()  # Инициализация детектора MTCNN
+        self.use_index = use_index  # Приближённый поиск по индексу для больших галерей
+        self.face_index = None  # Загружается при первом построении галереи
+        self.blur_engine = BlurEngine()  # Режим размытия: gaussian, box, pixelate или fill
+        self.detector = FaceDetector(self.min_face_size, self.thresholds, self.detection_size,
+                                     small_face_pass=self.small_faces)  # MTCNN создаётся при первой детекции
         self.load_face_encodings()  # Загрузка кодировок при инициализации
 
     def load_face_encodings(self):
-        """Загрузка кодировок лиц из файлов JSON."""
-        faces_folder = 'faces'
-        for name in os.listdir(faces_folder):
-            json_file_path = os.path.join(faces_folder, name, f"{name}.json")
-            if os.path.isfile(json_file_path):
-                with open(json_file_path, 'r') as json_file:
-                    data = json.load(json_file)
-                    self.face_encodings[name] = [face['encodings'] for face in data['files']]
-                    logging.info(f"Loaded {len(data['files'])} encodings for {name}.")
+        """Открытие хранилища кодировок лиц; данные читаются лениво через memmap."""
+        self.face_encodings = open_store('faces')
+        logging.info(f"Opened encoding store at {self.face_encodings.folder}.")
+
+    def warm_up(self):
+        """Предварительная загрузка моделей и индекса кодировок."""
+        timed_import('cv2')
+        timed_import('face_recognition')  # Импорт face_recognition загружает модели dlib
+        self.detector.load()
+        len(self.face_encodings)
 
     def choose_reference_faces(self):
         """Выбор референсных лиц для определения."""
@@ -64,53 +102,151 @@ class PhotoProcessingApp:
             logging.warning("No reference faces selected.")
             return
 
-        reference_encodings = self.get_reference_encodings()
+        reference_matcher = self.get_reference_matcher()
         file_path = filedialog.askopenfilename(title="Select Image", filetypes=[("Image files", "*.jpg *.jpeg *.png")])
         if file_path:
-            self.process_image(file_path, reference_encodings)  # Передаем кодировки референсных лиц
+            self.process_image(file_path, reference_matcher)  # Передаем галерею референсных лиц
         else:
             logging.warning("No image selected.")
 
-    def get_reference_encodings(self):
-        """Получаем кодировки референсных лиц."""
-        return [encoding for name in self.selected_faces for encoding in self.face_encodings.get(name, [])]
-
-    def resize_image(self, img, max_size=5000):
-        """Изменение размера изображения, если оно больше max_size."""
-        height, width = img.shape[:2]
-        if max(height, width) > max_size:
-            scale = max_size / max(height, width)
-            new_size = (int(width * scale), int(height * scale))
-            img = cv2.resize(img, new_size)
-            logging.info(f"Image resized to {new_size}.")
-        return img
-
-    def process_image(self, image_path, reference_encodings):
-        """Обработка загруженного изображения и распознавание лиц."""
-        img = face_recognition.load_image_file(image_path)
-        img = self.resize_image(img)  # Изменяем размер изображения
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # Преобразуем в RGB
-
-        face_boxes = self.detector.detect_faces(img_rgb, self.min_face_size, self.thresholds)
-        face_locations = self.extract_face_locations(face_boxes)
-
-        img_encodings = face_recognition.face_encodings(img_rgb, face_locations)
-        if not img_encodings:
+    def get_reference_matcher(self, update_index=True):
+        """Строим галерею кодировок выбранных референсных лиц.
+
+        update_index=False — индекс только читается (рабочие процессы пакетной
+        обработки); его дополняет родительский процесс или обучение.
+        """
+        if self.use_index and self.face_index is None:
+            self.face_index = gallery_index(self.face_encodings, self.selected_faces, update=update_index)
+        return ReferenceMatcher(self.face_encodings, self.selected_faces, index=self.face_index)
+
+    def process_image(self, image_path, reference_matcher, output_path="output_blurred.jpg"):
+        """Обработка загруженного изображения и распознавание лиц.
+
+        Возвращает путь к сохранённому изображению или None, если изображение пропущено.
+        """
+        timings = {}
+        with self.metrics.profile(os.path.basename(image_path)), self.metrics.timer('image', timings):
+            output_path, analysis = self._process_image(image_path, reference_matcher, output_path, timings)
+
+        faces = len(analysis.face_locations) if analysis is not None else 0
+        self.metrics.inc('images_processed' if output_path else 'images_skipped')
+        self.metrics.observe('faces_per_image', faces, buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200))
+        self.metrics.emit('image', path=image_path, output=output_path, faces=faces,
+                          timings={stage: round(seconds, 4) for stage, seconds in timings.items()},
+                          cache_hit_rate=self.cache_hit_rate())
+        return output_path
+
+    def _process_image(self, image_path, reference_matcher, output_path, timings):
+        img_rgb = None
+        cache_key, analysis = self.get_cached_analysis(image_path, timings)
+        if analysis is None:
+            img_rgb = self.load_image(image_path, timings)
+            analysis = self.analyze_image(img_rgb, timings)
+            if cache_key is not None:
+                with self.metrics.timer('cache_write', timings):
+                    self.analysis_cache.put(cache_key, analysis.face_boxes, analysis.encodings)
+
+        if not analysis.encodings:
             logging.warning("No faces found in the image.")
-            return
+            return None, analysis
 
-        reference_location = self.get_reference_location(img_encodings, face_locations, reference_encodings)
-        if reference_location is None:
+        with self.metrics.timer('match', timings):
+            self.match_reference_faces(analysis, reference_matcher)
+        if analysis.reference_location is None:
             logging.warning("Reference face not found in the image.")
-            return
+            return None, analysis
+
+        self.log_face_locations(analysis.face_locations)
+
+        if img_rgb is None:
+            img_rgb = self.load_image(image_path, timings)  # Анализ взят из кэша, изображение нужно только для размытия
+
+        # Этапы выбора лиц работают по одному результату анализа
+        with self.metrics.timer('blur', timings):
+            self.blur_faces(img_rgb, analysis)
+
+        with self.metrics.timer('save', timings):
+            metadata = read_metadata(image_path) if self.preserve_metadata else None
+            return self.save_image(img_rgb, output_path, metadata=metadata), analysis
+
+    def load_image(self, image_path, timings=None):
+        """Загрузка изображения для анализа и размытия."""
+        with self.metrics.timer('decode', timings):
+            # Без режима плиток большие изображения уменьшаются ещё при декодировании
+            return read_image(image_path, None if self.tile_size else self.max_image_size)
 
-        self.log_face_locations(face_locations)
+    def analysis_settings(self):
+        """Настройки, от которых зависит результат детекции и кодирования."""
+        settings = {
+            'min_face_size': self.min_face_size,
+            'thresholds': self.thresholds,
+            'max_image_size': None if self.tile_size else self.max_image_size,
+            'detection_size': self.detection_size,
+            'tile_size': self.tile_size,
+            'tile_overlap': self.tile_overlap if self.tile_size else None,
+            'channels': 'rgb',  # Ранние записи кэша вычислены по изображению с переставленными каналами
+        }
+        if self.detection_size and self.small_faces:
+            settings['small_faces'] = True  # Ранние записи с detection_size вычислены без этого прохода
+        return settings
 
-        # Этапы размытия лиц
-        self.blur_faces_with_recognition(img_rgb, face_locations, reference_encodings, reference_location)
-        self.blur_faces_with_mtcnn(img_rgb, face_boxes, reference_location)
+    def cache_hit_rate(self):
+        """Доля попаданий в кэш анализа с начала работы процесса; None, если кэш выключен."""
+        if self.analysis_cache is None:
+            return None
+        return round(self.metrics.hit_rate('analysis_cache'), 4)
 
-        self.save_image(img_rgb)
+    def get_cached_analysis(self, image_path, timings=None):
+        """Ключ кэша и сохранённый анализ изображения (None, если кэш выключен или записи нет)."""
+        if self.analysis_cache is None:
+            return None, None
+        with self.metrics.timer('cache_lookup', timings):
+            cache_key = self.analysis_cache.key(image_path, self.analysis_settings())
+            cached = self.analysis_cache.get(cache_key)
+        if cached is None:
+            self.metrics.inc('analysis_cache_misses')
+            return cache_key, None
+        self.metrics.inc('analysis_cache_hits')
+        face_boxes, encodings = cached
+        return cache_key, ImageAnalysis(face_boxes, self.extract_face_locations(face_boxes), encodings)
+
+    def analyze_image(self, img_rgb, timings=None):
+        """Детекция лиц и вычисление кодировок — один раз на изображение."""
+        with self.metrics.timer('detect', timings):
+            face_boxes, face_locations = self.detect_faces(img_rgb)
+        with self.metrics.timer('encode', timings):
+            encodings = self.encode_faces(img_rgb, face_locations)
+        return ImageAnalysis(face_boxes, face_locations, encodings)
+
+    def encode_faces(self, img_rgb, face_locations):
+        """Вычисление 128-мерных кодировок dlib для заданных координат лиц."""
+        if self.tile_size and max(img_rgb.shape[:2]) > self.tile_size:
+            return [self.encode_face_window(img_rgb, location) for location in face_locations]
+        return face_recognition.face_encodings(img_rgb, face_locations)
+
+    def encode_face_window(self, img_rgb, location):
+        """Кодировка одного лица по окну вокруг него, без копирования всего изображения."""
+        height, width = img_rgb.shape[:2]
+        top, right, bottom, left = location
+        pad = max(bottom - top, right - left) // 2
+        window_top, window_left = max(0, top - pad), max(0, left - pad)
+        window = np.ascontiguousarray(img_rgb[window_top:min(height, bottom + pad), window_left:min(width, right + pad)])
+        local_location = (top - window_top, right - window_left, bottom - window_top, left - window_left)
+        return face_recognition.face_encodings(window, [local_location])[0]
+
+    def detect_faces(self, img_rgb):
+        """Детекция лиц MTCNN; возвращает результаты MTCNN и координаты лиц."""
+        if self.tile_size and max(img_rgb.shape[:2]) > self.tile_size:
+            face_boxes = self.detector.detect_tiled(img_rgb, self.tile_size, self.tile_overlap, self.tile_workers)
+        else:
+            face_boxes = self.detector.detect_faces(img_rgb)
+        return face_boxes, self.extract_face_locations(face_boxes)
+
+    def match_reference_faces(self, analysis, reference_matcher):
+        """Вычисление расстояний до референсных лиц и поиск референсного лица."""
+        analysis.identities, analysis.distances = reference_matcher.match(analysis.encodings)
+        analysis.reference_location = self.get_reference_location(analysis)
+        return analysis
 
     def extract_face_locations(self, face_boxes):
         """Извлечение координат лиц из результатов MTCNN."""
@@ -118,60 +254,77 @@ class PhotoProcessingApp:
 
     def log_face_locations(self, face_locations):
         """Логирование координат найденных лиц."""
+        if not logging.getLogger().isEnabledFor(logging.DEBUG):
+            return
         for i, location in enumerate(face_locations):
-            logging.info(f"Face {i + 1}: Location {location}")
+            logging.debug(f"Face {i + 1}: Location {location}")
 
-    def get_reference_location(self, img_encodings, face_locations, reference_encodings):
+    def get_reference_location(self, analysis):
         """Получение координат референсного лица."""
-        for i, (face_encoding, location) in enumerate(zip(img_encodings, face_locations)):
-            distances = np.linalg.norm(reference_encodings - face_encoding, axis=1)
-            if np.min(distances) < 0.4:  # Пороговое значение
-                logging.info(f"Reference face found at location {location}.")
+        for location, distance in zip(analysis.face_locations, analysis.distances):
+            if distance < self.match_threshold:
+                logging.debug(f"Reference face found at location {location}.")
                 return location
         return None
 
-    def blur_faces_with_recognition(self, image, face_locations, reference_encodings, reference_location):
-        """Размываем лица на изображении, используя face_recognition."""
-        logging.info("Start blur_faces_with_recognition")
-        img_encodings = face_recognition.face_encodings(image, face_locations)
-
-        for (top, right, bottom, left), face_encoding in zip(face_locations, img_encodings):
-            distances = np.linalg.norm(reference_encodings - face_encoding, axis=1)
-            min_distance = np.min(distances)
-
-            if min_distance > 0.4 and not self.is_reference_face((top, right, bottom, left), reference_location):
-                roi = image[top:bottom, left:right]
-                blurred_roi = cv2.GaussianBlur(roi, (99, 99), 30)
-                image[top:bottom, left:right] = blurred_roi
-                logging.info(f"Blurred face at location {top, left, bottom, right}.")
-
-    def blur_faces_with_mtcnn(self, image, face_boxes, reference_location):
-        """Размываем лица на изображении, используя MTCNN."""
-        logging.info("Start blur_faces_with_mtcnn")
-        face_locations = self.extract_face_locations(face_boxes)
-        img_encodings = face_recognition.face_encodings(image, face_locations)
-
-        for (top, right, bottom, left), face_encoding in zip(face_locations, img_encodings):
-            if not self.is_reference_face((top, right, bottom, left), reference_location):
-                roi = image[top:bottom, left:right]
-                blurred_roi = cv2.GaussianBlur(roi, (99, 99), 30)
-                image[top:bottom, left:right] = blurred_roi
-                logging.info(f"Blurred face at location {top, left, bottom, right}.")
+    def select_faces_by_recognition(self, analysis):
+        """Лица, не совпавшие с референсными по кодировкам face_recognition."""
+        return [location for location, distance in zip(analysis.face_locations, analysis.distances)
+                if distance > self.match_threshold and not self.is_reference_face(location, analysis.reference_location)]
+
+    def select_faces_by_mtcnn(self, analysis):
+        """Все найденные MTCNN лица, кроме референсного."""
+        return [location for location in analysis.face_locations
+                if not self.is_reference_face(location, analysis.reference_location)]
+
+    def blur_faces(self, image, analysis):
+        """Размываем лица, выбранные обоими этапами, за один проход движка размытия."""
+        locations = list(dict.fromkeys(self.select_faces_by_recognition(analysis) + self.select_faces_by_mtcnn(analysis)))
+        self.blur_engine.apply(image, locations)
+        self.metrics.inc('faces_blurred', len(locations))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for top, right, bottom, left in locations:
+                logging.debug(f"Blurred face at location {top, left, bottom, right}.")
+        return locations
 
     def is_reference_face(self, face_location, reference_location):
         """Проверяем, является ли текущее лицо референсным."""
         return face_location == reference_location
 
-    def save_image(self, image):
-        """Сохраняем изображение в формате RGB."""
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(rgb_image)
-        blurred_image_path = "output_blurred.jpg"
-        pil_image.save(blurred_image_path, "JPEG")
-        logging.info(f"Image saved to {blurred_image_path}.")
+    def save_image(self, image, output_path="output_blurred.jpg", image_format=None, quality=None, metadata=None):
+        """Сохраняем изображение в формате RGB.
+
+        output_path может быть файловым объектом, тогда формат задаётся в image_format.
+        """
+        write_image(image, output_path, image_format, quality or self.jpeg_quality, metadata)
+        if isinstance(output_path, str):
+            logging.info(f"Image saved to {output_path}.")
+        return output_path
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_app():
+    """Общий экземпляр приложения, создаётся один раз."""
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = PhotoProcessingApp()
+        return _app
+
+
+def warm_up():
+    """Фоновая загрузка моделей, пока интерфейс простаивает."""
+    get_app().warm_up()
+
+
+def run_photo_processing():
+    get_app().upload_image()
+
 
 if __name__ == "__main__":
-    app = PhotoProcessingApp()
+    app = get_app()
     root = tk.Tk()
     root.title("Photo Processing Application")
     upload_button = tk.Button(root, text="Upload Image", command=app.upload_image)
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from encoding_store_module import open_store
+from face_matching_module import ENCODING_SIZE, ReferenceMatcher
+from image_io_module import read_metadata
+from metrics_module import REGISTRY
+
+STATUS_TEXT = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 408: 'Request Timeout',
+    411: 'Length Required', 413: 'Payload Too Large', 415: 'Unsupported Media Type', 422: 'Unprocessable Entity',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+# Состояние рабочего процесса: модели загружаются один раз на процесс в init_service_worker
+_worker_app = None
+
+
+def init_service_worker(detection_size=None, tile_size=None, small_faces=True):
+    """Инициализация рабочего процесса: загрузка MTCNN и dlib до первого запроса."""
+    global _worker_app
+    from photo_processing_module import PhotoProcessingApp
+
+    _worker_app = PhotoProcessingApp(detection_size=detection_size, tile_size=tile_size, small_faces=small_faces)
+    _worker_app.warm_up()
+
+
+def worker_ready():
+    return os.getpid()
+
+
+def analyze_upload(data):
+    """Детекция и кодирование лиц загруженного изображения в рабочем процессе."""
+    img_rgb = _worker_app.load_image(io.BytesIO(data))
+    analysis = _worker_app.analyze_image(img_rgb)
+    return analysis.face_boxes, np.asarray(analysis.encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+
+def blur_upload(data, face_boxes, distances, quality=90):
+    """Размытие лиц по готовому анализу; возвращает JPEG и число размытых лиц или None без референса."""
+    from photo_processing_module import ImageAnalysis
+
+    img_rgb = _worker_app.load_image(io.BytesIO(data))
+    analysis = ImageAnalysis(face_boxes, _worker_app.extract_face_locations(face_boxes), [])
+    analysis.distances = distances
+    analysis.reference_location = _worker_app.get_reference_location(analysis)
+    if analysis.reference_location is None:
+        return None, 0
+    locations = _worker_app.blur_faces(img_rgb, analysis)
+    buffer = io.BytesIO()
+    _worker_app.save_image(img_rgb, buffer, image_format='JPEG', quality=quality,
+                           metadata=read_metadata(io.BytesIO(data)))
+    return buffer.getvalue(), len(locations)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class MatchBatcher:
+    """Микропакетное сопоставление кодировок.
+
+    Кодировки одновременных запросов собираются в течение max_delay секунд
+    (или до max_batch лиц). Для каждого референсного лица, запрошенного хотя бы
+    одним запросом пакета, считается одно матричное умножение всех его лиц на
+    блок кодировок этого человека, так что стоимость растёт с размером
+    выбранных галерей, а не всего хранилища. Индекс FaceIndex здесь не
+    используется: он ищет ближайших соседей среди всех лиц, а запросам нужны
+    расстояния до своего набора людей, и для такого набора точный поиск по
+    блокам уже ограничен его размером.
+    """
+
+    def __init__(self, matcher, max_batch=64, max_delay=0.005, metrics=None):
+        self.matcher = matcher  # ReferenceMatcher по всем лицам хранилища, без индекса
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.metrics = metrics or REGISTRY
+        self.label_ids = {name: label for label, name in enumerate(matcher.names)}
+        # Кодировки каждого человека лежат в галерее одним блоком
+        self.label_offsets = np.searchsorted(matcher.labels, np.arange(len(matcher.names) + 1))
+        self._pending = []
+        self._faces = 0
+        self._timer = None
+        self._tasks = set()
+
+    def labels(self, names):
+        unknown = [name for name in names if name not in self.label_ids]
+        if unknown:
+            raise HttpError(400, f"Unknown reference faces: {', '.join(unknown)}")
+        return np.array([self.label_ids[name] for name in names], dtype=np.int32)
+
+    async def distances(self, encodings, names):
+        """Минимальное расстояние от каждого лица до выбранных референсных лиц."""
+        labels = self.labels(names)
+        if not len(encodings):
+            return np.empty(0, dtype=np.float32)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((encodings, labels, future))
+        self._faces += len(encodings)
+        if self._faces >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._faces = self._pending, [], 0
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._match(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def match_batch(self, batch):
+        """Минимальные расстояния для всех лиц пакета; каждое лицо сравнивается только со своими людьми."""
+        queries = np.concatenate([encodings for encodings, _, _ in batch])
+        best = np.full(len(queries), np.inf, dtype=np.float32)
+        query_ids = {}  # Метка -> номера лиц пакета, запросивших этого человека
+        offset = 0
+        for encodings, labels, _ in batch:
+            for label in labels:
+                query_ids.setdefault(int(label), []).append(np.arange(offset, offset + len(encodings)))
+            offset += len(encodings)
+        for label, ids in query_ids.items():
+            start, end = self.label_offsets[label], self.label_offsets[label + 1]
+            if start == end:
+                continue
+            ids = np.concatenate(ids)
+            distances = self.matcher.distances(queries[ids], slice(start, end)).min(axis=1)
+            best[ids] = np.minimum(best[ids], distances)
+        return best
+
+    async def _match(self, batch):
+        try:
+            # NumPy отпускает GIL, цикл событий продолжает принимать запросы
+            best = await asyncio.get_running_loop().run_in_executor(None, self.match_batch, batch)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.metrics.observe('service_match_batch_faces', len(best), buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+
+        offset = 0
+        for encodings, _, future in batch:
+            result = best[offset:offset + len(encodings)]
+            offset += len(encodings)
+            if not future.done():
+                future.set_result(result)
+
+
+class BlurService:
+    """HTTP-сервис размытия лиц на asyncio.
+
+    Тяжёлая работа выполняется в пуле заранее прогретых процессов, в каждом из
+    которых загружены MTCNN и dlib. Одновременно в пул передаётся не больше
+    workers задач, остальные запросы ждут в очереди; при переполнении очереди
+    сервис сразу отвечает 503.
+    """
+
+    def __init__(self, workers=None, max_pending=None, max_body_bytes=50 * 1024 * 1024, batch_size=64,
+                 batch_delay=0.005, detection_size=None, tile_size=None, quality=90, request_timeout=60.0,
+                 faces_folder='faces', metrics=None, small_faces=True):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4  # Запросы в работе и в очереди
+        self.max_body_bytes = max_body_bytes
+        self.detection_size = detection_size
+        self.tile_size = tile_size
+        self.small_faces = small_faces  # Проход по оригиналу для мелких лиц при detection_size
+        self.quality = quality
+        self.request_timeout = request_timeout
+        self.metrics = metrics or REGISTRY
+        self.pending = 0
+        self.executor = None
+        self.slots = None
+        self.batcher = MatchBatcher(ReferenceMatcher(open_store(faces_folder)), batch_size, batch_delay, self.metrics)
+
+    async def start(self):
+        """Запуск пула процессов и ожидание загрузки моделей во всех процессах."""
+        self.slots = asyncio.Semaphore(self.workers)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_service_worker,
+                                            initargs=(self.detection_size, self.tile_size, self.small_faces))
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self.executor, worker_ready) for _ in range(self.workers)))
+        logging.info(f"Service workers ready: {len(set(pids))} processes.")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run_in_worker(self, func, *args):
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def handle(self, reader, writer):
+        """Обработка одного HTTP-соединения (один запрос, затем соединение закрывается)."""
+        try:
+            try:
+                method, target, headers = await asyncio.wait_for(self.read_head(reader), self.request_timeout)
+                status, content_type, body, extra = await self.route(method, target, headers, reader, writer)
+            except HttpError as e:
+                status, content_type, extra = e.status, 'application/json', {}
+                body = json.dumps({'error': e.message}).encode()
+                if e.status == 503:
+                    extra['Retry-After'] = '1'
+            except ValueError:
+                status, content_type, body, extra = 400, 'application/json', b'{"error": "Malformed request"}', {}
+            except asyncio.TimeoutError:
+                status, content_type, body, extra = 408, 'application/json', b'{"error": "Request timeout"}', {}
+            except Exception as e:
+                logging.exception(f"Service request failed: {e}")
+                status, content_type, body, extra = 500, 'application/json', b'{"error": "Internal error"}', {}
+            self.metrics.inc(f'service_responses_{status}')
+            await self.write_response(writer, status, content_type, body, extra)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # Клиент закрыл соединение
+        finally:
+            writer.close()
+
+    async def read_head(self, reader):
+        request_line = await reader.readline()
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise HttpError(400, "Malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return parts[0], parts[1], headers
+
+    async def read_body(self, headers, reader, writer):
+        if 'content-length' not in headers:
+            raise HttpError(411, "Content-Length is required")
+        length = int(headers['content-length'])
+        if length > self.max_body_bytes:
+            raise HttpError(413, f"Image is larger than {self.max_body_bytes} bytes")
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+        return await asyncio.wait_for(reader.readexactly(length), self.request_timeout)
+
+    async def write_response(self, writer, status, content_type, body, extra=None):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", f"Content-Type: {content_type}",
+                 f"Content-Length: {len(body)}", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in (extra or {}).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def route(self, method, target, headers, reader, writer):
+        url = urlsplit(target)
+        if url.path == '/health':
+            state = {'workers': self.workers, 'pending': self.pending, 'max_pending': self.max_pending}
+            return 200, 'application/json', json.dumps(state).encode(), {}
+        if url.path == '/metrics':
+            return 200, 'text/plain; version=0.0.4', self.metrics.to_prometheus().encode(), {}
+        if url.path != '/blur':
+            raise HttpError(404, "Unknown path")
+        if method != 'POST':
+            raise HttpError(405, "Use POST with the image as the request body")
+
+        query = parse_qs(url.query)
+        names = [name for value in query.get('faces', []) for name in value.split(',') if name]
+        if not names:
+            raise HttpError(400, "Pass reference identities as ?faces=name1,name2")
+        self.batcher.labels(names)  # Неизвестные имена отклоняются до чтения тела
+        quality = int(query.get('quality', [self.quality])[0])
+        if not 1 <= quality <= 95:
+            raise HttpError(400, "quality must be between 1 and 95")
+
+        # Очередь ограничена: лишние запросы отклоняются до чтения тела
+        if self.pending >= self.max_pending:
+            self.metrics.inc('service_rejected')
+            raise HttpError(503, "Service is busy")
+        self.pending += 1
+        try:
+            data = await self.read_body(headers, reader, writer)
+            with self.metrics.timer('service_request'):
+                return await self.blur(data, names, quality)
+        finally:
+            self.pending -= 1
+
+    async def blur(self, data, names, quality):
+        try:
+            face_boxes, encodings = await self.run_in_worker(analyze_upload, data)
+        except UnidentifiedImageError:
+            raise HttpError(415, "The upload is not a supported image")
+        except Image.DecompressionBombError:
+            raise HttpError(413, "The image has too many pixels")
+        except (OSError, SyntaxError) as e:  # Так PIL сообщает о повреждённых и обрезанных файлах
+            raise HttpError(400, f"Cannot decode the image: {e}")
+        if not len(encodings):
+            raise HttpError(422, "No faces found in the image")
+        distances = await self.batcher.distances(encodings, names)
+        image, blurred = await self.run_in_worker(blur_upload, data, face_boxes, distances, quality)
+        if image is None:
+            raise HttpError(422, "Reference face not found in the image")
+        return 200, 'image/jpeg', image, {'X-Faces-Found': str(len(face_boxes)), 'X-Faces-Blurred': str(blurred)}
+
+
+async def serve(host='127.0.0.1', port=8080, **kwargs):
+    service = BlurService(**kwargs)
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    logging.info(f"Blur service listening on http://{host}:{port}/blur")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP service that blurs faces except the given reference identities.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to bind (localhost by default)")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="Requests in progress or queued before answering 503 (default: 4 per worker)")
+    parser.add_argument('--max-body-mb', type=float, default=50, help="Largest accepted upload")
+    parser.add_argument('--batch-size', type=int, default=64, help="Faces per matching micro-batch")
+    parser.add_argument('--batch-delay-ms', type=float, default=5, help="Longest wait to fill a matching batch")
+    parser.add_argument('--detection-size', type=int, default=None,
+                        help="Run face detection on a copy with this longest side (e.g. 1600); faces too small "
+                             "for the copy are then searched in an extra full-resolution pass")
+    parser.add_argument('--skip-small-faces', action='store_true',
+                        help="With --detection-size, skip the full-resolution pass: faster, but faces smaller "
+                             "than about 5 * image side / detection size pixels are not blurred")
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help="Process large images in overlapping tiles of this size instead of downscaling them")
+    parser.add_argument('--quality', type=int, default=90, help="Default JPEG quality of responses")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+                          max_body_bytes=int(args.max_body_mb * 1024 * 1024), batch_size=args.batch_size,
+                          batch_delay=args.batch_delay_ms / 1000, detection_size=args.detection_size,
+                          tile_size=args.tile_size, quality=args.quality, small_faces=not args.skip_small_faces))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
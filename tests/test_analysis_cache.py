@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+
+from analysis_cache_module import AnalysisCache
+
+
+def face_box(x, confidence=0.75, keypoints=True):  # Уверенность хранится во float32
+    box = {'box': [x, 20, 30, 40], 'confidence': confidence}
+    if keypoints:
+        box['keypoints'] = {'left_eye': (x + 5, 30), 'right_eye': (x + 20, 30), 'nose': (x + 12, 40),
+                            'mouth_left': (x + 6, 50), 'mouth_right': (x + 19, 50)}
+    return box
+
+
+def test_round_trip(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    face_boxes = [face_box(10), face_box(100, confidence=0.5, keypoints=False)]
+    encodings = np.random.default_rng(0).random((2, 128), dtype=np.float32)
+    cache.put('ab_key', face_boxes, encodings)
+
+    cached_boxes, cached_encodings = cache.get('ab_key')
+    assert cached_boxes[0] == face_boxes[0]
+    assert cached_boxes[1] == {'box': [100, 20, 30, 40], 'confidence': 0.5}
+    np.testing.assert_array_equal(np.array(cached_encodings), encodings)
+    assert cache.get('ab_other') is None
+
+
+def test_image_without_faces(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    cache.put('cd_empty', [], [])
+    assert cache.get('cd_empty') == ([], [])
+
+
+def test_key_depends_on_content_and_settings(tmp_path):
+    cache = AnalysisCache(str(tmp_path / 'cache'))
+    first, second = tmp_path / 'a.jpg', tmp_path / 'b.jpg'
+    first.write_bytes(b'same')
+    second.write_bytes(b'same')
+    assert cache.key(str(first), {'size': 1}) == cache.key(str(second), {'size': 1})
+    assert cache.key(str(first), {'size': 1}) != cache.key(str(first), {'size': 2})
+    second.write_bytes(b'other')
+    assert cache.key(str(first), {'size': 1}) != cache.key(str(second), {'size': 1})
+
+
+def test_oldest_entries_are_evicted(tmp_path):
+    encodings = np.zeros((1, 128), dtype=np.float32)
+    probe = AnalysisCache(str(tmp_path / 'probe'))
+    probe.put('00_probe', [face_box(0)], encodings)
+    entry_size = os.path.getsize(probe._path('00_probe'))
+
+    cache = AnalysisCache(str(tmp_path / 'cache'), max_bytes=int(entry_size * 3.5))
+    for i in range(3):
+        cache.put(f"{i:02d}_entry", [face_box(i)], encodings)
+        os.utime(cache._path(f"{i:02d}_entry"), (1000 + i, 1000 + i))
+    cache.get('00_entry')  # Чтение обновляет время использования: самой старой становится запись 01
+    cache.put('03_entry', [face_box(3)], encodings)
+
+    assert cache.get('01_entry') is None
+    assert all(cache.get(f"{i:02d}_entry") is not None for i in (0, 2, 3))
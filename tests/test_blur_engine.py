@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from blur_engine_module import BLUR_MODES, BlurEngine, clip_box, merge_boxes
+
+
+def test_clip_box_to_image():
+    assert clip_box((-5, 120, 90, -3), (80, 100, 3)) == (0, 100, 80, 0)
+
+
+def test_merge_boxes_groups_overlapping_faces():
+    shape = (200, 200, 3)
+    locations = [(10, 50, 50, 10), (30, 70, 70, 30), (100, 150, 150, 100), (10, 50, 50, 10)]
+    regions = sorted(merge_boxes(locations, shape))
+    assert regions[0] == ((10, 70, 70, 10), [(10, 50, 50, 10), (30, 70, 70, 30)])
+    assert regions[1] == ((100, 150, 150, 100), [(100, 150, 150, 100)])
+
+
+def test_merge_boxes_drops_empty_boxes():
+    assert merge_boxes([(50, 10, 40, 20), (300, 400, 350, 320)], (200, 200, 3)) == []
+
+
+@pytest.mark.parametrize('mode', BLUR_MODES)
+def test_apply_changes_only_face_pixels(mode):
+    image = np.random.default_rng(0).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    original = image.copy()
+    locations = [(10, 60, 60, 10), (40, 90, 90, 40)]  # Пересекающиеся лица с общей областью
+    BlurEngine(mode).apply(image, locations)
+
+    mask = np.zeros(image.shape[:2], dtype=bool)
+    for top, right, bottom, left in locations:
+        mask[top:bottom, left:right] = True
+    assert (image[~mask] == original[~mask]).all()
+    assert (image[mask] != original[mask]).any()
+    assert (image[60:90, 10:40] == original[60:90, 10:40]).all()  # Угол общей рамки вне лиц
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        BlurEngine('smudge')
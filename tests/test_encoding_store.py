@@ -0,0 +1,87 @@
+import numpy as np
+
+from encoding_store_module import EncodingStore
+
+
+def encodings(count, seed=0):
+    return np.random.default_rng(seed).random((count, 128), dtype=np.float32)
+
+
+def test_append_and_read_back(tmp_path):
+    store = EncodingStore(str(tmp_path))
+    first, second = encodings(2, 1), encodings(3, 2)
+    store.append('alice', 'a1.jpg', first, mtime=1.0, size=10)
+    store.append('bob', 'b1.jpg', second)
+    store.append('carol', 'empty.jpg', encodings(0))
+
+    reopened = EncodingStore(str(tmp_path))
+    assert sorted(reopened) == ['alice', 'bob']  # Файл без лиц не создаёт имени
+    np.testing.assert_array_equal(reopened['alice'], first)
+    np.testing.assert_array_equal(reopened['bob'], second)
+    assert reopened.files('alice')['a1.jpg']['mtime'] == 1.0
+    assert 'empty.jpg' in reopened.files('carol')
+
+
+def test_remove_and_compact(tmp_path):
+    store = EncodingStore(str(tmp_path))
+    store.append('alice', 'a1.jpg', encodings(2, 1))
+    store.append('alice', 'a2.jpg', encodings(1, 2))
+    store.append('bob', 'b1.jpg', encodings(1, 3))
+    store.remove('bob', 'b1.jpg')
+    assert list(store) == ['alice']
+
+    store.compact()
+    reopened = EncodingStore(str(tmp_path))
+    assert reopened.row_count == 3
+    assert list(reopened) == ['alice']
+    np.testing.assert_array_equal(reopened['alice'][2], encodings(1, 2)[0])
+
+
+def test_stale_instance_does_not_truncate_other_writers(tmp_path):
+    a = EncodingStore(str(tmp_path))
+    a.append('alice', 'a1.jpg', encodings(2, 1))
+    b = EncodingStore(str(tmp_path))
+    assert len(b) == 1  # b читает хранилище и запоминает число строк
+    a.append('alice', 'a2.jpg', encodings(3, 2))
+    b.append('bob', 'b1.jpg', encodings(1, 3))
+
+    reopened = EncodingStore(str(tmp_path))
+    assert reopened.matrix.shape == (6, 128)
+    np.testing.assert_array_equal(reopened['alice'][2:], encodings(3, 2))
+    np.testing.assert_array_equal(reopened['bob'], encodings(1, 3))
+
+
+def test_refresh_sees_other_writers(tmp_path):
+    reader = EncodingStore(str(tmp_path))
+    writer = EncodingStore(str(tmp_path))
+    writer.append('alice', 'a1.jpg', encodings(1))
+    assert list(reader) == ['alice']
+    assert not reader.refresh()
+
+    writer.append('bob', 'b1.jpg', encodings(1, 1))
+    assert reader.refresh()
+    assert list(reader) == ['alice', 'bob']
+
+
+def test_partial_index_line_is_ignored_and_repaired(tmp_path):
+    store = EncodingStore(str(tmp_path))
+    store.append('alice', 'a1.jpg', encodings(1))
+    with open(store.index_path, 'a') as index_file:
+        index_file.write('{"name": "bob", "file_na')  # Сбой посреди записи
+
+    reopened = EncodingStore(str(tmp_path))
+    assert list(reopened) == ['alice']
+    reopened.append('carol', 'c1.jpg', encodings(1, 1))
+    assert sorted(EncodingStore(str(tmp_path))) == ['alice', 'carol']
+
+
+def test_identities_include_names_without_faces(tmp_path):
+    store = EncodingStore(str(tmp_path))
+    store.append('alice', 'a1.jpg', encodings(1))
+    store.append('bob', 'empty.jpg', encodings(0))
+    assert store.identities() == ['alice', 'bob']
+
+    for file_name in list(store.files('alice')):
+        store.remove('alice', file_name)
+    reopened = EncodingStore(str(tmp_path))
+    assert reopened.identities() == ['bob'] and list(reopened) == []
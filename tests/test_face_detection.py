@@ -0,0 +1,72 @@
+import numpy as np
+
+from face_detection_module import FaceDetector, iter_tiles, non_max_suppression, transform_face_box
+
+
+def face(x, y, width, height, confidence):
+    return {'box': [x, y, width, height], 'confidence': confidence}
+
+
+def test_transform_face_box_scales_box_and_keypoints():
+    face_box = dict(face(10, 20, 30, 40, 0.9), keypoints={'nose': (25, 35)})
+    transformed = transform_face_box(face_box, scale=2.0, offset_x=100, offset_y=5)
+    assert transformed['box'] == [120, 45, 60, 80]
+    assert transformed['keypoints'] == {'nose': (150, 75)}
+    assert face_box['box'] == [10, 20, 30, 40]  # Исходная рамка не меняется
+
+
+def test_nms_keeps_most_confident_of_overlapping_boxes():
+    boxes = [face(0, 0, 100, 100, 0.8), face(5, 5, 100, 100, 0.99), face(300, 300, 50, 50, 0.7)]
+    assert non_max_suppression(boxes) == [boxes[1], boxes[2]]
+
+
+def test_nms_drops_box_contained_in_another():
+    outer, inner = face(0, 0, 200, 200, 0.99), face(10, 10, 60, 60, 0.95)  # IoU 0.09, но рамка внутри
+    assert non_max_suppression([inner, outer]) == [outer]
+
+
+def test_nms_keeps_separate_faces_in_original_order():
+    boxes = [face(0, 0, 50, 50, 0.7), face(60, 0, 50, 50, 0.9), face(120, 0, 50, 50, 0.8)]
+    assert non_max_suppression(boxes) == boxes
+    assert non_max_suppression([]) == []
+
+
+def test_tiles_cover_image_with_overlap():
+    tiles = list(iter_tiles(5000, 3000, tile_size=2048, overlap=256))
+    assert tiles[0] == (0, 2048, 2048, 0)
+    covered = np.zeros((5000, 3000), dtype=bool)
+    for top, right, bottom, left in tiles:
+        assert bottom - top <= 2048 and right - left <= 2048
+        covered[top:bottom, left:right] = True
+    assert covered.all()
+    # Соседние плитки перекрываются на overlap, чтобы лицо на границе целиком попало в одну из них
+    assert tiles[1][3] == 2048 - 256
+
+
+def test_single_tile_for_small_image():
+    assert list(iter_tiles(100, 200, tile_size=2048, overlap=256)) == [(0, 200, 100, 0)]
+
+
+
+class FakeDetector(FaceDetector):
+    """MTCNN-заглушка: на копии видно только крупное лицо, в полном разрешении — светлый квадрат мелкого лица."""
+
+    def detect_raw(self, img):
+        if max(img.shape[:2]) <= self.detection_size:
+            return [face(10, 10, 40, 40, 0.99)]
+        ys, xs = np.nonzero(img[:, :, 0])
+        if not len(ys) or ys.max() == img.shape[0] - 1 or xs.max() == img.shape[1] - 1:
+            return []  # Лица нет или оно обрезано краем плитки
+        return [face(int(xs.min()), int(ys.min()), int(xs.max() - xs.min() + 1), int(ys.max() - ys.min() + 1), 0.99)]
+
+
+def detect_with_proxy(small_face_pass):
+    detector = FakeDetector(detection_size=100, small_face_pass=small_face_pass, small_face_tile=400)
+    img = np.zeros((1000, 1000, 3), dtype=np.uint8)
+    img[700:720, 600:620] = 255  # Лицо 20px: на копии 1:10 оно меньше min_face_size
+    return sorted(face_box['box'] for face_box in detector.detect_faces(img))
+
+
+def test_small_faces_are_found_at_full_resolution():
+    assert detect_with_proxy(small_face_pass=True) == [[100, 100, 400, 400], [600, 700, 20, 20]]
+    assert detect_with_proxy(small_face_pass=False) == [[100, 100, 400, 400]]
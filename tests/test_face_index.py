@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmark_module import synthetic_gallery
+from encoding_store_module import DATA_FILE, EncodingStore
+from face_index_module import INDEX_FILE, FaceIndex, gallery_index, kmeans, open_index
+
+
+def filled_store(tmp_path, size=400, identities=10):
+    store = EncodingStore(str(tmp_path))
+    for name, encodings in synthetic_gallery(size, identities=identities).items():
+        store.append(name, f"{name}.jpg", encodings)
+    return store
+
+
+def test_kmeans_assigns_every_point():
+    points = np.random.default_rng(0).random((100, 128), dtype=np.float32)
+    centroids, assignments = kmeans(points, 10)
+    assert centroids.shape == (10, 128)
+    assert assignments.shape == (100,) and assignments.max() < 10
+
+
+def test_index_is_persisted_and_extended(tmp_path):
+    store = filled_store(tmp_path)
+    index = open_index(store)
+    assert len(index.assignments) == store.row_count
+
+    store.append('new', 'new.jpg', np.zeros((5, 128), dtype=np.float32))
+    reloaded = FaceIndex(str(tmp_path)).load()
+    np.testing.assert_array_equal(reloaded.centroids, index.centroids)
+    assert reloaded.update(store)
+    assert len(reloaded.assignments) == store.row_count
+    np.testing.assert_array_equal(reloaded.centroids, index.centroids)  # Новые строки без перестройки
+    assert not FaceIndex(str(tmp_path)).load().update(store)
+
+
+def test_index_rebuilds_after_store_rewrite(tmp_path):
+    store = filled_store(tmp_path)
+    first = sorted(store)[0]
+    store.remove(first, f"{first}.jpg")
+    rows_before = store.row_count
+    open_index(store)
+
+    store.compact()  # Номера строк сдвигаются
+    store.append('filler', 'filler.jpg', np.zeros((rows_before - store.row_count, 128), dtype=np.float32))
+    assert store.row_count == rows_before
+
+    index = FaceIndex(str(tmp_path)).load()
+    assert index.update(store)
+    assert index.generation == store.generation
+    expected = np.argmin(((np.asarray(store.matrix)[:, None, :] - index.centroids[None]) ** 2).sum(axis=2), axis=1)
+    np.testing.assert_array_equal(index.assignments, expected)
+
+
+def test_probe_returns_nearest_clusters(tmp_path):
+    index = open_index(filled_store(tmp_path))
+    probes = index.probe(index.centroids[:3], 2)
+    assert probes.shape == (3, 2)
+    for i in range(3):
+        assert i in probes[i]
+
+
+def test_concurrent_open_index_builds_once(tmp_path):
+    filled_store(tmp_path, size=1000, identities=20)
+    stores = [EncodingStore(str(tmp_path)) for _ in range(6)]
+    with ThreadPoolExecutor(len(stores)) as executor:
+        indexes = list(executor.map(open_index, stores))
+    for index in indexes:
+        np.testing.assert_array_equal(index.assignments, indexes[0].assignments)
+    assert sorted(os.listdir(tmp_path)) == sorted([DATA_FILE, 'encodings_index.jsonl', '.encodings.lock', INDEX_FILE])
+
+
+def test_small_gallery_gets_no_index(tmp_path):
+    store = filled_store(tmp_path)
+    assert gallery_index(store, list(store)) is None
+    assert not os.path.exists(os.path.join(tmp_path, INDEX_FILE))
+    assert gallery_index(store, list(store), min_index_size=1) is not None
+
+
+def test_read_only_index_ignored_when_stale(tmp_path):
+    store = filled_store(tmp_path)
+    open_index(store)
+    assert gallery_index(store, list(store), min_index_size=1, update=False) is not None
+
+    store.append('new', 'new.jpg', np.zeros((5, 128), dtype=np.float32))
+    assert gallery_index(store, list(store), min_index_size=1, update=False) is None
+    assert len(FaceIndex(str(tmp_path)).load().assignments) == store.row_count - 5  # Файл индекса не тронут
@@ -0,0 +1,52 @@
+import numpy as np
+
+from benchmark_module import synthetic_gallery
+from encoding_store_module import EncodingStore
+from face_index_module import open_index
+from face_matching_module import ReferenceMatcher
+
+
+def test_match_returns_nearest_identity():
+    gallery = {'alice': np.zeros((2, 128), dtype=np.float32), 'bob': np.ones((1, 128), dtype=np.float32)}
+    matcher = ReferenceMatcher(gallery)
+    identities, distances = matcher.match(np.array([np.full(128, 0.9), np.full(128, 0.1)], dtype=np.float32))
+    assert identities == ['bob', 'alice']
+    np.testing.assert_allclose(distances, [0.1 * np.sqrt(128)] * 2, rtol=1e-4)
+
+
+def test_empty_gallery_matches_nothing():
+    identities, distances = ReferenceMatcher({}).match(np.zeros((3, 128), dtype=np.float32))
+    assert identities == [None] * 3 and np.isinf(distances).all()
+
+
+def indexed_store(tmp_path, size=3000, identities=60):
+    store = EncodingStore(str(tmp_path))
+    gallery = synthetic_gallery(size, identities=identities)
+    store.write((name, f"{name}.jpg", encodings, {}) for name, encodings in gallery.items())
+    return store, gallery, open_index(store)
+
+
+def test_indexed_match_agrees_with_brute_force(tmp_path):
+    store, gallery, index = indexed_store(tmp_path)
+    names = sorted(gallery)[:20]
+    rng = np.random.default_rng(3)
+    queries = np.concatenate([gallery[name][:2] for name in names])
+    queries += rng.normal(0, 0.005, queries.shape).astype(np.float32)
+
+    indexed = ReferenceMatcher(store, names, index=index, min_index_size=1)
+    brute = ReferenceMatcher(store, names)
+    assert indexed.index is not None
+    indexed_identities, indexed_distances = indexed.match(queries)
+    brute_identities, brute_distances = brute.match(queries)
+    assert indexed_identities == brute_identities
+    np.testing.assert_allclose(indexed_distances, brute_distances, atol=1e-4)
+    assert (indexed_distances >= brute_distances - 1e-4).all()  # Индекс может только завысить расстояние
+
+
+def test_indexed_match_falls_back_without_candidates(tmp_path):
+    store, gallery, index = indexed_store(tmp_path)
+    name = sorted(gallery)[0]
+    matcher = ReferenceMatcher(store, [name], index=index, n_probe=1, min_index_size=1)
+    far_query = -gallery[sorted(gallery)[-1]][:1]  # Ближайший кластер не содержит кодировок name
+    identities, distances = matcher.match(far_query)
+    assert identities == [name] and np.isfinite(distances).all()
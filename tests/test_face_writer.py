@@ -0,0 +1,83 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from face_writer_module import STATE_FILE, FaceStoreWriter, difference_hash, hamming_distances, open_writer
+
+
+def face(seed):
+    """Гладкое случайное лицо BGR: dHash разных seed заметно различается."""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (8, 9, 3), dtype=np.uint8)
+    return np.repeat(np.repeat(small, 16, axis=0), 16, axis=1)
+
+
+def test_hamming_distances():
+    hashes = np.array([0, 0b1011, 2 ** 64 - 1], dtype=np.uint64)
+    assert hamming_distances(hashes, 0b1).tolist() == [1, 2, 63]
+    assert len(hamming_distances(np.empty(0, dtype=np.uint64), 0)) == 0
+
+
+def test_faces_are_numbered_and_duplicates_skipped(tmp_path):
+    writer = FaceStoreWriter(str(tmp_path), 'alice', batch_size=10)
+    assert writer.add(face(1))
+    assert not writer.add(face(1))  # Такое же лицо уже ждёт записи
+    assert writer.add(face(2))
+    saved = writer.flush()
+    assert [os.path.basename(path) for path in saved] == ['alice_0.jpg', 'alice_1.jpg']
+    assert not writer.add(face(2))  # И после записи
+    assert writer.flush() == []
+
+
+def test_state_survives_reopen(tmp_path):
+    writer = FaceStoreWriter(str(tmp_path), 'alice')
+    writer.add(face(1))
+    writer.flush()
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert state['next_index'] == 1
+    assert list(state['hashes']) == ['alice_0.jpg']
+
+    reopened = FaceStoreWriter(str(tmp_path), 'alice')
+    assert not reopened.add(face(1))
+    reopened.add(face(3))
+    assert [os.path.basename(path) for path in reopened.flush()] == ['alice_1.jpg']
+
+
+def test_reconciles_files_added_and_removed_by_hand(tmp_path):
+    writer = FaceStoreWriter(str(tmp_path), 'alice')
+    writer.add(face(1))
+    writer.flush()
+    os.remove(tmp_path / 'alice_0.jpg')
+    cv2.imwrite(str(tmp_path / 'alice_7.jpg'), face(4))
+
+    reopened = FaceStoreWriter(str(tmp_path), 'alice')
+    assert list(reopened.hashes) == ['alice_7.jpg']
+    assert reopened.next_index == 8
+    assert reopened.add(face(1))  # Удалённое лицо можно сохранить снова
+    assert not reopened.add(face(4))
+
+
+def test_existing_file_is_never_overwritten(tmp_path):
+    writer = FaceStoreWriter(str(tmp_path), 'alice')
+    (tmp_path / 'alice_0.jpg').write_bytes(b'written by another process')
+    writer.add(face(1))
+    assert [os.path.basename(path) for path in writer.flush()] == ['alice_1.jpg']
+    assert (tmp_path / 'alice_0.jpg').read_bytes() == b'written by another process'
+    assert difference_hash(face(1)) in writer.hashes.values()
+
+
+def test_face_save_reuses_one_writer_per_folder(tmp_path, monkeypatch):
+    from face_selection_module import Face
+
+    scans = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: scans.append(path) or real_scandir(path))
+    output_dir = str(tmp_path / 'bob')
+    saved = [Face('unused.jpg', (0, 144, 128, 0), crop=face(seed)).save('bob', output_dir) for seed in (5, 6, 5)]
+
+    assert [os.path.basename(path) for path in saved[:2]] == ['bob_0.jpg', 'bob_1.jpg']
+    assert saved[2] is None  # Повтор первого лица
+    assert scans == [output_dir]  # Каталог просмотрен один раз
+    assert open_writer(output_dir, 'bob') is open_writer(output_dir, 'bob')
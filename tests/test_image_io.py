@@ -0,0 +1,70 @@
+import io
+import struct
+
+import numpy as np
+from PIL import Image
+
+from image_io_module import read_image, read_metadata, write_image
+
+THUMBNAIL = b'\xff\xd8UNBLURRED-THUMBNAIL\xff\xd9'
+MAKER_NOTE = b'VENDOR-PREVIEW-JPEG'
+
+
+def ifd(entries, next_offset=0):
+    data = struct.pack('<H', len(entries))
+    for tag, field_type, count, value in entries:
+        data += struct.pack('<HHII', tag, field_type, count, value)
+    return data + struct.pack('<I', next_offset)
+
+
+def exif_with_thumbnail():
+    """EXIF с ориентацией, MakerNote и миниатюрой в IFD1, собранный вручную."""
+    ifd0_offset = 8
+    exif_offset = ifd0_offset + 2 + 2 * 12 + 4
+    maker_note_offset = exif_offset + 2 + 12 + 4
+    ifd1_offset = maker_note_offset + len(MAKER_NOTE) + len(MAKER_NOTE) % 2
+    thumbnail_offset = ifd1_offset + 2 + 2 * 12 + 4
+
+    tiff = b'II*\x00' + struct.pack('<I', ifd0_offset)
+    tiff += ifd([(0x0112, 3, 1, 6), (0x8769, 4, 1, exif_offset)], next_offset=ifd1_offset)
+    tiff += ifd([(0x927C, 7, len(MAKER_NOTE), maker_note_offset)])
+    tiff += MAKER_NOTE + b'\x00' * (len(MAKER_NOTE) % 2)
+    tiff += ifd([(0x0201, 4, 1, thumbnail_offset), (0x0202, 4, 1, len(THUMBNAIL))])
+    tiff += THUMBNAIL
+    return b'Exif\x00\x00' + tiff
+
+
+def source_jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (120, 80, 40)).save(buffer, format='JPEG', exif=exif_with_thumbnail())
+    return buffer.getvalue()
+
+
+def test_output_drops_exif_thumbnail_and_maker_note():
+    data = source_jpeg()
+    assert THUMBNAIL in data and MAKER_NOTE in data
+
+    pixels = read_image(io.BytesIO(data))
+    output = io.BytesIO()
+    write_image(pixels, output, image_format='JPEG', metadata=read_metadata(io.BytesIO(data)))
+
+    result = output.getvalue()
+    assert THUMBNAIL not in result
+    assert MAKER_NOTE not in result
+    with Image.open(io.BytesIO(result)) as image:
+        assert image.getexif()[0x0112] == 6  # Ориентация сохраняется
+
+
+def test_read_image_returns_writable_rgb():
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 20), (255, 0, 0)).save(buffer, format='PNG')
+    pixels = read_image(io.BytesIO(buffer.getvalue()))
+    assert pixels.shape == (20, 40, 3) and pixels.flags.writeable
+    assert tuple(pixels[0, 0]) == (255, 0, 0)
+
+
+def test_read_image_downscales_large_jpeg():
+    buffer = io.BytesIO()
+    Image.fromarray(np.zeros((1000, 2000, 3), dtype=np.uint8)).save(buffer, format='JPEG')
+    pixels = read_image(io.BytesIO(buffer.getvalue()), max_size=500)
+    assert pixels.shape == (250, 500, 3)
@@ -0,0 +1,21 @@
+import sys
+import threading
+import time
+
+from lazy_import_module import IMPORT_TIMES, lazy_import
+
+
+def test_lazy_module_waits_for_import_in_another_thread(tmp_path, monkeypatch):
+    (tmp_path / 'slow_module_for_test.py').write_text('import time\ntime.sleep(0.3)\nVALUE = 42\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'slow_module_for_test', raising=False)
+
+    warm_up = threading.Thread(target=__import__, args=('slow_module_for_test',))
+    warm_up.start()
+    while 'slow_module_for_test' not in sys.modules:  # Импорт в фоновом потоке уже начался
+        time.sleep(0.001)
+    module = lazy_import('slow_module_for_test')
+    assert module.VALUE == 42
+    warm_up.join()
+    assert 'slow_module_for_test' not in IMPORT_TIMES  # Время импорта записал бы только сам импортёр
+    monkeypatch.delitem(sys.modules, 'slow_module_for_test')
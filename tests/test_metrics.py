@@ -0,0 +1,54 @@
+import os
+
+from metrics_module import Histogram, MetricsRegistry
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 2]  # Граница корзины включается в неё
+    assert histogram.count == 5 and histogram.total == 5.65
+
+
+def test_prometheus_output():
+    registry = MetricsRegistry(prefix='app')
+    registry.inc('images_processed', 3)
+    registry.inc('cache_hits', 3)
+    registry.inc('cache_misses')
+    registry.observe('decode_seconds', 0.05, buckets=(0.1, 1.0))
+    registry.observe('decode_seconds', 0.5, buckets=(0.1, 1.0))
+    registry.observe('decode_seconds', 5.0, buckets=(0.1, 1.0))
+
+    lines = registry.to_prometheus().splitlines()
+    assert 'app_images_processed_total 3' in lines
+    assert 'app_cache_misses_total 1' in lines
+    assert '# TYPE app_cache_hit_ratio gauge' in lines
+    assert 'app_cache_hit_ratio 0.7500' in lines
+    assert lines[lines.index('# TYPE app_decode_seconds histogram') + 1:] == [
+        'app_decode_seconds_bucket{le="0.1"} 1',
+        'app_decode_seconds_bucket{le="1.0"} 2',  # Корзины накопительные
+        'app_decode_seconds_bucket{le="+Inf"} 3',
+        'app_decode_seconds_sum 5.55',
+        'app_decode_seconds_count 3',
+    ]
+    assert registry.hit_rate('cache') == 0.75
+    assert registry.hit_rate('unknown') == 0.0
+
+
+def test_every_nth_block_is_profiled(tmp_path):
+    registry = MetricsRegistry()
+    registry.configure_profiling(str(tmp_path), every=3)
+    for i in range(7):
+        with registry.profile(f"image {i}.jpg"):
+            sum(range(100))
+    names = sorted(os.listdir(tmp_path))
+    assert [name.split('_', 1)[1] for name in names] == ['image_2.jpg.prof', 'image_5.jpg.prof']
+
+
+def test_events_reach_sinks():
+    registry = MetricsRegistry()
+    events = []
+    registry.add_sink(events.append)
+    registry.emit('image', path='a.jpg', cache_hit_rate=0.5)
+    assert events[0]['event'] == 'image' and events[0]['cache_hit_rate'] == 0.5
@@ -0,0 +1,28 @@
+import os
+
+from model_training_module import scan_folder
+
+
+def known(path):
+    stat = os.stat(path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size, 'rows': [0]}
+
+
+def test_scan_reports_new_changed_and_deleted_files(tmp_path):
+    for name in ('same.jpg', 'changed.jpg', 'new.png'):
+        (tmp_path / name).write_bytes(b'face')
+    (tmp_path / 'notes.txt').write_text('ignored')
+    known_files = {'same.jpg': known(tmp_path / 'same.jpg'), 'changed.jpg': known(tmp_path / 'changed.jpg'),
+                   'gone.jpg': {'mtime': 1.0, 'size': 4, 'rows': [1]}}
+    (tmp_path / 'changed.jpg').write_bytes(b'another face')
+
+    changed, deleted = scan_folder(str(tmp_path), known_files)
+    assert sorted(changed) == ['changed.jpg', 'new.png']
+    assert changed['changed.jpg']['size'] == len(b'another face')
+    assert deleted == ['gone.jpg']
+
+
+def test_migrated_files_without_mtime_are_current(tmp_path):
+    (tmp_path / 'migrated.jpg').write_bytes(b'face')
+    changed, deleted = scan_folder(str(tmp_path), {'migrated.jpg': {'rows': [0]}})
+    assert changed == {} and deleted == []
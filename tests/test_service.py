@@ -0,0 +1,73 @@
+import asyncio
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import service_module
+from face_matching_module import ReferenceMatcher
+from image_io_module import read_image
+from service_module import BlurService, HttpError, MatchBatcher
+
+
+def gallery():
+    rng = np.random.default_rng(0)
+    return {name: rng.normal(0, 0.1, (count, 128)).astype(np.float32)
+            for name, count in (('alice', 3), ('bob', 2), ('carol', 4))}
+
+
+def test_batched_distances_use_only_requested_identities():
+    faces = gallery()
+    matcher = ReferenceMatcher(faces)
+    batcher = MatchBatcher(matcher, max_batch=100, max_delay=0.001)
+    rng = np.random.default_rng(1)
+    requests = [(rng.normal(0, 0.1, (2, 128)).astype(np.float32), ['alice']),
+                (rng.normal(0, 0.1, (3, 128)).astype(np.float32), ['bob', 'carol'])]
+
+    async def run():
+        return await asyncio.gather(*(batcher.distances(encodings, names) for encodings, names in requests))
+
+    results = asyncio.run(run())
+    for (encodings, names), result in zip(requests, results):
+        expected = ReferenceMatcher(faces, names).distances(encodings).min(axis=1)
+        np.testing.assert_allclose(result, expected, rtol=1e-5)
+
+
+def test_unknown_identity_is_rejected():
+    batcher = MatchBatcher(ReferenceMatcher(gallery()))
+    with pytest.raises(HttpError) as error:
+        batcher.labels(['alice', 'mallory'])
+    assert error.value.status == 400
+
+
+def service(tmp_path):
+    return BlurService(workers=1, faces_folder=str(tmp_path))
+
+
+def test_quality_out_of_range_is_rejected(tmp_path):
+    blur_service = service(tmp_path)
+    blur_service.batcher.label_ids = {'alice': 0}
+    with pytest.raises(HttpError) as error:
+        asyncio.run(blur_service.route('POST', '/blur?faces=alice&quality=200', {}, None, None))
+    assert error.value.status == 400
+
+
+def truncated_jpeg():
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8)).save(buffer, 'JPEG')
+    return buffer.getvalue()[:400]
+
+
+@pytest.mark.parametrize('data, status', [(b'not an image', 415), (truncated_jpeg(), 400)])
+def test_undecodable_upload_is_a_client_error(tmp_path, monkeypatch, data, status):
+    blur_service = service(tmp_path)
+
+    async def decode_in_place(func, upload):
+        return read_image(io.BytesIO(upload))
+
+    monkeypatch.setattr(blur_service, 'run_in_worker', decode_in_place)
+    with pytest.raises(HttpError) as error:
+        asyncio.run(blur_service.blur(data, ['alice'], 90))
+    assert error.value.status == status
+    assert service_module.STATUS_TEXT[status]
@@ -0,0 +1,28 @@
+import cv2
+import numpy as np
+import pytest
+
+from video_processing_module import VideoBlurrer, box_iou, main
+
+
+def test_box_iou():
+    assert box_iou((0, 10, 10, 0), (0, 10, 10, 0)) == 1.0
+    assert box_iou((0, 10, 10, 0), (0, 20, 10, 10)) == 0.0
+    assert box_iou((0, 10, 10, 0), (0, 15, 10, 5)) == pytest.approx(1 / 3)
+
+
+def test_unwritable_output_raises(tmp_path):
+    input_path = str(tmp_path / 'input.avi')
+    writer = cv2.VideoWriter(input_path, cv2.VideoWriter_fourcc(*'MJPG'), 25.0, (64, 48))
+    assert writer.isOpened()
+    writer.write(np.zeros((48, 64, 3), dtype=np.uint8))
+    writer.release()
+
+    blurrer = VideoBlurrer(app=None, reference_matcher=None)
+    with pytest.raises(IOError):
+        blurrer.process_video(input_path, str(tmp_path / 'missing' / 'output.mp4'))
+
+
+def test_detection_interval_must_be_positive():
+    with pytest.raises(SystemExit):
+        main(['input.mp4', 'output.mp4', '--faces', 'alice', '--detection-interval', '0'])
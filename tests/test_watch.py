@@ -0,0 +1,56 @@
+import json
+
+from watch_module import PollingWatcher, WatchJournal, file_signature
+
+
+def test_journal_resumes_only_finished_files(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = WatchJournal(path)
+    journal.record('a.jpg', (1, 10), 'done', faces=2)
+    journal.record('b.jpg', (2, 20), 'error', error='boom')
+    journal.record('c.jpg', (3, 30), 'skipped')
+
+    resumed = WatchJournal(path)
+    assert resumed.is_done('a.jpg', (1, 10))
+    assert not resumed.is_done('a.jpg', (1, 11))  # Файл изменился после обработки
+    assert not resumed.is_done('b.jpg', (2, 20))  # Ошибку повторяем
+    assert resumed.is_done('c.jpg', (3, 30))
+    assert not resumed.is_done('d.jpg', (4, 40))
+
+
+def test_journal_ignores_partial_last_line(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    WatchJournal(str(path)).record('a.jpg', (1, 10), 'done')
+    with open(path, 'a') as journal_file:
+        journal_file.write('{"path": "b.jpg", "sta')
+
+    journal = WatchJournal(str(path))
+    assert list(journal.entries) == ['a.jpg']
+
+
+def test_journal_compacts_repeated_records(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = WatchJournal(str(path))
+    for attempt in range(5):
+        journal.record('a.jpg', (1, 10), 'error' if attempt < 4 else 'done')
+
+    resumed = WatchJournal(str(path))
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['status'] == 'done'
+    assert resumed.is_done('a.jpg', (1, 10))
+
+
+def test_polling_reports_file_once_it_stops_changing(tmp_path):
+    image_path = tmp_path / 'photo.jpg'
+    image_path.write_bytes(b'part')
+    (tmp_path / 'notes.txt').write_text('ignored')
+    watcher = PollingWatcher(str(tmp_path), interval=0)
+
+    assert watcher.wait(0) == []  # Первый просмотр: подпись ещё не с чем сравнить
+    with open(image_path, 'ab') as image_file:
+        image_file.write(b' more')
+    assert watcher.wait(0) == []  # Размер изменился — файл ещё пишется
+    assert watcher.wait(0) == [str(image_path)]
+    assert file_signature(str(image_path))[1] == len(b'part more')
+    assert file_signature(str(tmp_path / 'missing.jpg')) is None
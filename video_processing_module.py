@@ -0,0 +1,208 @@
+import argparse
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from photo_processing_module import ImageAnalysis, PhotoProcessingApp
+
+TRACKING_SIZE = 640  # Максимальная сторона кадра для оптического потока и поиска смены сцены
+
+
+def box_iou(a, b):
+    """IoU двух рамок (top, right, bottom, left)."""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class FaceTrack:
+    """Отслеживаемое лицо: рамка и кэшированная кодировка между кадрами детекции."""
+
+    def __init__(self, location, encoding, frame_index):
+        self.location = location
+        self.encoding = encoding
+        self.encoded_at = frame_index
+
+
+class FaceTracker:
+    """Дешёвый трекер: сдвигает рамки на медианный оптический поток точек внутри них."""
+
+    def __init__(self, max_corners=20):
+        self.max_corners = max_corners
+        self.tracks = []
+        self.prev_gray = None
+        self.scale = 1.0
+
+    def small_gray(self, frame):
+        """Уменьшенный серый кадр для трекинга."""
+        height, width = frame.shape[:2]
+        self.scale = min(1.0, TRACKING_SIZE / max(height, width))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.scale < 1.0:
+            gray = cv2.resize(gray, (int(width * self.scale), int(height * self.scale)), interpolation=cv2.INTER_AREA)
+        return gray
+
+    def update(self, gray, frame_shape):
+        """Перенос рамок на новый кадр."""
+        if self.prev_gray is not None:
+            height, width = frame_shape[:2]
+            for track in self.tracks:
+                dx, dy = self._displacement(gray, track.location)
+                top, right, bottom, left = track.location
+                dx = int(np.clip(dx, -left, width - right))
+                dy = int(np.clip(dy, -top, height - bottom))
+                track.location = (top + dy, right + dx, bottom + dy, left + dx)
+        self.prev_gray = gray
+
+    def _displacement(self, gray, location):
+        top, right, bottom, left = (int(value * self.scale) for value in location)
+        mask = np.zeros_like(self.prev_gray)
+        mask[max(top, 0):bottom, max(left, 0):right] = 255
+        points = cv2.goodFeaturesToTrack(self.prev_gray, self.max_corners, 0.01, 3, mask=mask)
+        if points is None:
+            return 0.0, 0.0
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None)
+        good = status.ravel() == 1
+        if not good.any():
+            return 0.0, 0.0
+        dx, dy = np.median((next_points[good] - points[good]).reshape(-1, 2), axis=0) / self.scale
+        return dx, dy
+
+
+class VideoBlurrer:
+    """Потоковое размытие видео: детекция раз в N кадров или при смене сцены, между ними — трекинг."""
+
+    def __init__(self, app, reference_matcher, detection_interval=10, scene_change_threshold=0.5,
+                 reencode_interval=30, iou_threshold=0.5):
+        self.app = app
+        self.reference_matcher = reference_matcher
+        self.detection_interval = detection_interval
+        self.scene_change_threshold = scene_change_threshold
+        self.reencode_interval = reencode_interval  # Через сколько кадров обновлять кэшированную кодировку
+        self.iou_threshold = iou_threshold
+        self.tracker = FaceTracker()
+        self.prev_hist = None
+
+    def is_scene_change(self, gray):
+        hist = cv2.calcHist([gray], [0], None, [64], [0, 256])
+        cv2.normalize(hist, hist)
+        changed = self.prev_hist is not None and \
+            cv2.compareHist(self.prev_hist, hist, cv2.HISTCMP_CORREL) < 1.0 - self.scene_change_threshold
+        self.prev_hist = hist
+        return changed
+
+    def detect(self, frame, frame_index):
+        """Детекция лиц; кодировки берутся из кэша треков, если лицо уже известно."""
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        face_boxes, face_locations = self.app.detect_faces(rgb)
+
+        tracks = []
+        to_encode = []
+        for index, location in enumerate(face_locations):
+            cached = max(self.tracker.tracks, key=lambda track: box_iou(track.location, location), default=None)
+            if cached is not None and box_iou(cached.location, location) >= self.iou_threshold \
+                    and frame_index - cached.encoded_at < self.reencode_interval:
+                tracks.append(FaceTrack(location, cached.encoding, cached.encoded_at))
+            else:
+                tracks.append(FaceTrack(location, None, frame_index))
+                to_encode.append(index)
+
+        if to_encode:
+            encodings = self.app.encode_faces(rgb, [face_locations[index] for index in to_encode])
+            for index, encoding in zip(to_encode, encodings):
+                tracks[index].encoding = encoding
+
+        self.tracker.tracks = tracks
+        return face_boxes
+
+    def analyze(self, face_boxes=None):
+        """Анализ кадра по текущим трекам для этапов размытия."""
+        locations = [track.location for track in self.tracker.tracks]
+        if face_boxes is None:
+            face_boxes = [{'box': [left, top, right - left, bottom - top]} for top, right, bottom, left in locations]
+        analysis = ImageAnalysis(face_boxes, locations, [track.encoding for track in self.tracker.tracks])
+        if analysis.encodings:
+            self.app.match_reference_faces(analysis, self.reference_matcher)
+        return analysis
+
+    def process_video(self, input_path, output_path):
+        """Чтение, размытие и запись видео кадр за кадром; память не зависит от длины видео."""
+        capture = cv2.VideoCapture(input_path)
+        if not capture.isOpened():
+            raise IOError(f"Cannot open video {input_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        fourcc = cv2.VideoWriter_fourcc(*('XVID' if output_path.lower().endswith('.avi') else 'mp4v'))
+        writer = cv2.VideoWriter(output_path, fourcc, fps, size)
+        if not writer.isOpened():
+            capture.release()
+            raise IOError(f"Cannot open video writer for {output_path}")
+
+        frame_index = 0
+        detections = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                gray = self.tracker.small_gray(frame)
+                scene_changed = self.is_scene_change(gray)
+                if scene_changed:
+                    self.tracker.tracks = []  # Кэш лиц не переносится через смену сцены
+                self.tracker.update(gray, frame.shape)
+
+                if scene_changed or frame_index % self.detection_interval == 0:
+                    analysis = self.analyze(self.detect(frame, frame_index))
+                    detections += 1
+                else:
+                    analysis = self.analyze()
+
+                if analysis.face_locations:
+                    self.app.blur_faces(frame, analysis)
+                writer.write(frame)
+
+                frame_index += 1
+                if frame_index % 100 == 0:
+                    logging.info(f"{frame_index} frames, {frame_index / (time.perf_counter() - start):.1f} fps")
+        finally:
+            capture.release()
+            writer.release()
+
+        elapsed = time.perf_counter() - start
+        stats = {
+            'frames': frame_index,
+            'detections': detections,
+            'seconds': elapsed,
+            'fps': frame_index / elapsed if elapsed else 0.0,
+        }
+        logging.info(f"Video saved to {output_path}: {frame_index} frames, {detections} detections, "
+                     f"{stats['fps']:.1f} fps.")
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Blur faces in a video except the selected reference identities.")
+    parser.add_argument('input', help="Input video file")
+    parser.add_argument('output', help="Output video file (.mp4 or .avi)")
+    parser.add_argument('-f', '--faces', nargs='+', required=True, help="Reference identity names to keep unblurred")
+    parser.add_argument('-n', '--detection-interval', type=int, default=10, help="Run detection every N frames")
+    args = parser.parse_args(argv)
+    if args.detection_interval < 1:
+        parser.error("--detection-interval must be at least 1")
+
+    app = PhotoProcessingApp()
+    app.selected_faces = args.faces
+    blurrer = VideoBlurrer(app, app.get_reference_matcher(), detection_interval=args.detection_interval)
+    blurrer.process_video(args.input, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
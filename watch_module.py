@@ -0,0 +1,364 @@
+import argparse
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import queue
+import select
+import struct
+import threading
+import time
+
+from image_io_module import read_metadata
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+JOURNAL_FILE = 'watch_journal.jsonl'
+
+# Флаги inotify из <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def file_signature(path):
+    """(mtime, размер) файла или None, если файла уже нет."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def list_images(folder):
+    return [entry.path for entry in os.scandir(folder)
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+class InotifyWatcher:
+    """Ожидание новых файлов через inotify (Linux), без сторонних зависимостей."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Файл готов, когда его закрыли после записи или переместили в каталог целиком
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+
+    def wait(self, timeout):
+        """Пути файлов, записанных за время ожидания."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify queue overflowed, rescanning the folder.")
+                return list_images(self.folder)
+            if name:
+                paths.append(os.path.join(self.folder, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Периодический просмотр каталога; файл считается готовым, когда его размер и mtime перестали меняться."""
+
+    def __init__(self, folder, interval=2.0):
+        self.folder = folder
+        self.interval = interval
+        self._previous = {}
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        current = {path: file_signature(path) for path in list_images(self.folder)}
+        stable = [path for path, signature in current.items() if signature and self._previous.get(path) == signature]
+        self._previous = current
+        return stable
+
+    def close(self):
+        pass
+
+
+def create_watcher(folder, polling=False, interval=2.0):
+    """inotify, если доступен, иначе опрос каталога."""
+    if not polling:
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:  # AttributeError — в libc нет inotify (не Linux)
+            logging.info(f"inotify is not available ({e}), polling {folder} every {interval}s.")
+    return PollingWatcher(folder, interval)
+
+
+class WatchJournal:
+    """Журнал обработанных файлов в формате JSON Lines.
+
+    Для каждого файла хранится последний результат и подпись (mtime, размер);
+    после перезапуска файлы с той же подписью не обрабатываются повторно,
+    а изменённые и завершившиеся ошибкой — обрабатываются.
+    """
+
+    FINAL_STATUSES = ('done', 'skipped')
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        lines = 0
+        with open(self.path, 'r') as journal_file:
+            for line in journal_file:
+                if not line.endswith('\n'):
+                    break  # Запись оборвалась при аварийной остановке
+                record = json.loads(line)
+                self.entries[record['path']] = record
+                lines += 1
+        if lines > 2 * len(self.entries):
+            self.compact()
+
+    def compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as journal_file:
+            for record in self.entries.values():
+                journal_file.write(json.dumps(record) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def is_done(self, path, signature):
+        record = self.entries.get(path)
+        return record is not None and record['status'] in self.FINAL_STATUSES and \
+            tuple(record['signature']) == tuple(signature)
+
+    def record(self, path, signature, status, **fields):
+        record = dict(fields, path=path, signature=list(signature), status=status, time=time.time())
+        with self._lock:
+            self.entries[path] = record
+            with open(self.path, 'a') as journal_file:
+                journal_file.write(json.dumps(record) + '\n')
+
+
+class WatchItem:
+    """Изображение на пути по конвейеру."""
+
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.timings = {}
+        self.image = None
+        self.metadata = None
+        self.cache_key = None
+        self.analysis = None
+
+
+class FolderWatcher:
+    """Непрерывная обработка изображений, появляющихся в каталоге.
+
+    Конвейер из трёх этапов — декодирование, детекция и кодирование, размытие
+    и сохранение — связан очередями ограниченного размера, поэтому при
+    медленной детекции приём новых файлов приостанавливается, а не копит
+    изображения в памяти. Этапы работают в потоках одного процесса: декодирование
+    и сжатие JPEG отпускают GIL, а кадры не копируются между процессами.
+    Галерея перечитывается, когда обучение дописывает кодировки.
+    """
+
+    def __init__(self, app, input_dir, output_dir='output', journal_path=None, decode_workers=2, analyze_workers=1,
+                 blur_workers=2, queue_size=8, polling=False, poll_interval=2.0, reload_interval=5.0):
+        if os.path.realpath(input_dir) == os.path.realpath(output_dir):
+            raise ValueError("The output folder must differ from the watched folder.")
+        self.app = app
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.journal = WatchJournal(journal_path or os.path.join(output_dir, JOURNAL_FILE))
+        self.workers = {'decode': decode_workers, 'analyze': analyze_workers, 'blur': blur_workers}
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in self.workers}
+        self.polling = polling
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval  # Как часто проверять изменения хранилища кодировок
+        self.reference_matcher = app.get_reference_matcher()
+        self._matcher_lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._accepted = {}  # Путь -> подпись файлов, принятых в этом запуске; ошибки повторяются после перезапуска
+        self._accepted_lock = threading.Lock()
+        self._threads = {}
+        self._stop = threading.Event()
+
+    def current_matcher(self):
+        """Галерея референсных лиц; пересобирается, если хранилище кодировок изменилось."""
+        with self._matcher_lock:
+            now = time.monotonic()
+            if now - self._checked_at >= self.reload_interval:
+                self._checked_at = now
+                if self.app.face_encodings.refresh():
+                    self.app.face_index = None  # Индекс тоже перечитывается и дополняется
+                    self.reference_matcher = self.app.get_reference_matcher()
+                    logging.info(f"Reloaded reference gallery: {len(self.reference_matcher)} encodings.")
+            return self.reference_matcher
+
+    def submit(self, path):
+        """Постановка файла в очередь; блокируется, пока в конвейере нет места."""
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            return
+        signature = file_signature(path)
+        if signature is None or self.journal.is_done(path, signature):
+            return
+        with self._accepted_lock:
+            if self._accepted.get(path) == signature:
+                return
+            self._accepted[path] = signature
+        self.queues['decode'].put(WatchItem(path, signature))
+
+    def finish(self, item, status, **fields):
+        self.journal.record(item.path, item.signature, status, **fields)
+        self.app.metrics.inc('images_processed' if status == 'done' else f'images_{status}')
+        self.app.metrics.emit('image', path=item.path, status=status, output=fields.get('output'),
+                              timings={stage: round(seconds, 4) for stage, seconds in item.timings.items()},
+                              cache_hit_rate=self.app.cache_hit_rate())
+
+    def decode(self, item):
+        app = self.app
+        item.cache_key, item.analysis = app.get_cached_analysis(item.path, item.timings)
+        item.image = app.load_image(item.path, item.timings)
+        if app.preserve_metadata:
+            item.metadata = read_metadata(item.path)
+        return item
+
+    def analyze(self, item):
+        app = self.app
+        if item.analysis is None:
+            item.analysis = app.analyze_image(item.image, item.timings)
+            if item.cache_key is not None:
+                with app.metrics.timer('cache_write', item.timings):
+                    app.analysis_cache.put(item.cache_key, item.analysis.face_boxes, item.analysis.encodings)
+        if not item.analysis.encodings:
+            self.finish(item, 'skipped', reason='no faces')
+            return None
+        with app.metrics.timer('match', item.timings):
+            app.match_reference_faces(item.analysis, self.current_matcher())
+        if item.analysis.reference_location is None:
+            self.finish(item, 'skipped', reason='reference face not found')
+            return None
+        return item
+
+    def blur(self, item):
+        app = self.app
+        with app.metrics.timer('blur', item.timings):
+            app.blur_faces(item.image, item.analysis)
+        output_path = os.path.join(self.output_dir, os.path.basename(item.path))
+        with app.metrics.timer('save', item.timings):
+            app.save_image(item.image, output_path, metadata=item.metadata)
+        self.finish(item, 'done', output=output_path)
+
+    def _run_stage(self, stage, func, next_stage):
+        inbox = self.queues[stage]
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            try:
+                result = func(item)
+            except Exception as e:
+                logging.error(f"Error processing {item.path} ({stage}): {e}")
+                self.finish(item, 'failed', error=str(e))
+                continue
+            if result is not None and next_stage is not None:
+                self.queues[next_stage].put(result)
+
+    def start(self):
+        stages = (('decode', self.decode, 'analyze'), ('analyze', self.analyze, 'blur'), ('blur', self.blur, None))
+        for stage, func, next_stage in stages:
+            self._threads[stage] = [threading.Thread(target=self._run_stage, args=(stage, func, next_stage),
+                                                     name=f"watch-{stage}-{i}", daemon=True)
+                                    for i in range(self.workers[stage])]
+            for thread in self._threads[stage]:
+                thread.start()
+
+    def stop(self):
+        """Дообработка уже принятых файлов и остановка этапов по порядку."""
+        self._stop.set()
+        for stage, threads in self._threads.items():
+            for _ in threads:
+                self.queues[stage].put(None)
+            for thread in threads:
+                thread.join()
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        watcher = create_watcher(self.input_dir, self.polling, self.poll_interval)
+        self.start()
+        try:
+            # Файлы, появившиеся, пока наблюдение было остановлено
+            for path in sorted(list_images(self.input_dir)):
+                self.submit(path)
+            logging.info(f"Watching {self.input_dir} for new images.")
+            while not self._stop.is_set():
+                for path in watcher.wait(1.0):
+                    self.submit(path)
+        finally:
+            watcher.close()
+            self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Blur faces in images as they appear in a folder.")
+    parser.add_argument('input_dir', help="Folder to watch for new images")
+    parser.add_argument('-f', '--faces', nargs='+', required=True, help="Reference identity names to keep unblurred")
+    parser.add_argument('-o', '--output-dir', default='output', help="Directory for blurred images")
+    parser.add_argument('--journal', default=None, help=f"Processed-files journal (default: OUTPUT_DIR/{JOURNAL_FILE})")
+    parser.add_argument('--decode-workers', type=int, default=2)
+    parser.add_argument('--analyze-workers', type=int, default=1, help="Threads running detection and encoding")
+    parser.add_argument('--blur-workers', type=int, default=2)
+    parser.add_argument('--queue-size', type=int, default=8, help="Images buffered between pipeline stages")
+    parser.add_argument('--poll', action='store_true', help="Poll the folder instead of using inotify")
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    parser.add_argument('--detection-size', type=int, default=None,
+                        help="Run face detection on a copy with this longest side (e.g. 1600); faces too small "
+                             "for the copy are then searched in an extra full-resolution pass")
+    parser.add_argument('--skip-small-faces', action='store_true',
+                        help="With --detection-size, skip the full-resolution pass: faster, but faces smaller "
+                             "than about 5 * image side / detection size pixels are not blurred")
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help="Process large images in overlapping tiles of this size instead of downscaling them")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Directory for cached detections and encodings, reused across runs")
+    parser.add_argument('--quality', type=int, default=90, help="JPEG quality of the blurred images")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from analysis_cache_module import AnalysisCache
+    from photo_processing_module import PhotoProcessingApp
+
+    app = PhotoProcessingApp(detection_size=args.detection_size, tile_size=args.tile_size,
+                             small_faces=not args.skip_small_faces,
+                             analysis_cache=AnalysisCache(args.cache_dir) if args.cache_dir else None)
+    app.selected_faces = list(args.faces)
+    app.jpeg_quality = args.quality
+    app.warm_up()
+
+    watcher = FolderWatcher(app, args.input_dir, args.output_dir, args.journal, args.decode_workers,
+                            args.analyze_workers, args.blur_workers, args.queue_size, args.poll, args.poll_interval)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logging.info("Stopping, finishing images already in the pipeline.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())